@@ -10,7 +10,7 @@ from django.utils import timezone
 from django.db import transaction
 from django.core.paginator import Paginator
 from django.db.models import Q, Sum, Count
-import json
+import orjson
 from decimal import Decimal
 from datetime import datetime, timedelta
 
@@ -77,7 +77,7 @@ def user_points_detail(request):
 def transfer_points(request):
     """ポイント転送"""
     try:
-        data = json.loads(request.body)
+        data = orjson.loads(request.body)
         recipient_id = data.get('recipient_id')
         points = int(data.get('points', 0))
         message = data.get('message', '')
@@ -252,7 +252,7 @@ def mark_notification_read(request, notification_id):
 def create_refund_request(request):
     """ポイント払戻し申請"""
     try:
-        data = json.loads(request.body)
+        data = orjson.loads(request.body)
         points_to_refund = int(data.get('points_to_refund', 0))
         refund_type = data.get('refund_type')
         reason = data.get('reason', '')
@@ -395,7 +395,7 @@ def admin_refund_requests(request):
 def process_refund_request(request, request_id):
     """管理者用: 払戻し申請処理"""
     try:
-        data = json.loads(request.body)
+        data = orjson.loads(request.body)
         action = data.get('action')  # 'approve' or 'reject'
         admin_notes = data.get('admin_notes', '')
         
@@ -593,7 +593,7 @@ def admin_areas_manage(request):
     
     elif request.method == "POST":
         try:
-            data = json.loads(request.body)
+            data = orjson.loads(request.body)
             name = data.get('name', '').strip()
             display_order = int(data.get('display_order', 0))
             
@@ -657,7 +657,7 @@ def admin_area_detail(request, area_id):
     
     elif request.method == "PUT":
         try:
-            data = json.loads(request.body)
+            data = orjson.loads(request.body)
             name = data.get('name', '').strip()
             display_order = int(data.get('display_order', 0))
             is_active = data.get('is_active', True)
@@ -833,7 +833,7 @@ def admin_email_template_detail(request, template_id):
     
     elif request.method == "PUT":
         try:
-            data = json.loads(request.body)
+            data = orjson.loads(request.body)
             
             # テンプレート更新
             template.subject = data.get('subject', template.subject)
@@ -906,7 +906,7 @@ def admin_email_logs(request):
 def admin_retry_failed_emails(request):
     """管理者用: 失敗したメールの再送信"""
     try:
-        data = json.loads(request.body)
+        data = orjson.loads(request.body)
         max_age_hours = int(data.get('max_age_hours', 24))
         
         retry_count = email_service.retry_failed_emails(max_age_hours)
@@ -930,7 +930,7 @@ def admin_retry_failed_emails(request):
 def admin_send_test_email(request):
     """管理者用: テストメール送信"""
     try:
-        data = json.loads(request.body)
+        data = orjson.loads(request.body)
         template_name = data.get('template_name')
         recipient_email = data.get('recipient_email')
         test_context = data.get('context', {})
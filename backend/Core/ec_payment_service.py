@@ -7,7 +7,7 @@ import time
 from decimal import Decimal
 
 from .models import Store, ECPointRequest, DepositTransaction
-from .fincode_service import fincode_service
+from .fincode_service import get_fincode_service
 from .deposit_service import deposit_service
 
 logger = logging.getLogger(__name__)
@@ -100,7 +100,7 @@ class ECPaymentService:
             # 複数回リトライ
             for attempt in range(self.retry_attempts):
                 try:
-                    result = fincode_service.process_payment(**payment_data)
+                    result = get_fincode_service().process_payment(**payment_data)
                     
                     if result.get('success'):
                         return {
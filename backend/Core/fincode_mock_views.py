@@ -0,0 +1,131 @@
+# GMO FINCODE 決済 API ビュー（モック）
+# FINCODE_MOCK 有効時に fincode_urls から選択される。決済系以外の処理は fincode_views を共用する
+
+from django.views.decorators.http import require_POST, require_http_methods
+from django.views.decorators.csrf import csrf_exempt
+from django.http import HttpResponse
+from django.template.loader import get_template
+import orjson
+import time
+import random
+import logging
+from .fincode_views import OrjsonResponse, _initiate_params, _validate_initiate_params
+
+logger = logging.getLogger(__name__)
+
+# モック時に返す決済ステータス候補
+MOCK_PAYMENT_STATUSES = ("pending", "processing", "completed", "failed")
+
+
+@csrf_exempt
+@require_POST
+def initiate_payment(request):
+    """
+    決済開始（モック）。入力検証→ローカルのモック決済ページURLを返却。
+    """
+    try:
+        body = orjson.loads(request.body or b"{}")
+        amount, order_id, payment_method, customer_id = _initiate_params(body)
+        
+        error_response = _validate_initiate_params(amount, order_id, customer_id)
+        if error_response is not None:
+            return error_response
+
+        base_url = request.build_absolute_uri('/').rstrip('/')
+
+        logger.info("🎭 Mock mode: returning success for order_id=%s", order_id)
+        # ローカルモック決済ページURL
+        mock_response = {
+            "id": f"MOCK_{int(time.time())}_{random.randint(1000, 9999)}",
+            "order_id": order_id,
+            "amount": amount,
+            "status": "UNPROCESSED",
+            "pay_type": payment_method,
+            "redirect_url": f"{base_url}/api/fincode/mock-payment/{order_id}/?method={payment_method}&amount={amount}",
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "updated": time.strftime("%Y-%m-%dT%H:%M:%S")
+        }
+        
+        return OrjsonResponse({
+            "success": True,
+            "mock": True,
+            "fincode": mock_response,
+            "payment_id": mock_response["id"],
+            "redirect_url": mock_response["redirect_url"],
+            "order_id": order_id,
+            "status": "pending"
+        }, status=200)
+
+    except orjson.JSONDecodeError as e:
+        logger.error("❌ JSON decode error: %s", e)
+        return OrjsonResponse({"success": False, "error": "INVALID_JSON", "detail": "無効なJSONデータです"}, status=400)
+    
+    except ValueError as e:
+        logger.error("❌ Value error: %s", e)
+        return OrjsonResponse({"success": False, "error": "INVALID_DATA", "detail": str(e)}, status=400)
+    
+    except Exception as e:
+        logger.error("❌ Unexpected error: %s", e)
+        return OrjsonResponse({"success": False, "error": "SERVER_EXCEPTION", "detail": str(e)}, status=500)
+
+
+@csrf_exempt
+@require_http_methods(["GET"])
+def check_payment_status(request, payment_id):
+    """決済状態確認API（モック: ランダムで状態を返す）"""
+    logger.info("🔍 Checking payment status: %s", payment_id)
+    
+    return OrjsonResponse({
+        "success": True,
+        "mock": True,
+        "status": random.choice(MOCK_PAYMENT_STATUSES),
+        "payment_id": payment_id,
+        "order_id": f"ORDER_{int(time.time())}",
+        "amount": 30000,
+        "payment_method": "card",
+        "updated_at": time.strftime("%Y-%m-%dT%H:%M:%S")
+    })
+
+
+@csrf_exempt
+@require_POST
+def refund_payment(request, payment_id):
+    """返金処理API（モック）"""
+    try:
+        body = orjson.loads(request.body or b"{}")
+    except orjson.JSONDecodeError:
+        return OrjsonResponse({"success": False, "error": "INVALID_JSON"}, status=400)
+    
+    amount = body.get("amount")  # 部分返金の場合
+    logger.info("💸 FINCODE refund request: payment_id=%s, amount=%s", payment_id, amount)
+    
+    return OrjsonResponse({
+        "success": True,
+        "mock": True,
+        "refund_id": f"REFUND_MOCK_{int(time.time())}",
+        "refund_amount": amount or 30000,
+        "status": "completed"
+    })
+
+
+def mock_payment_page(request, order_id):
+    """
+    モック決済ページ
+    実際の決済処理をシミュレートするHTMLページを返す
+    """
+    method = request.GET.get('method', 'card')
+    amount = request.GET.get('amount', '0')
+    
+    # パラメータログ
+    logger.info("🎭 Mock payment page accessed: order_id=%s, method=%s, amount=%s", order_id, method, amount)
+    
+    # 決済ページHTMLを返す
+    html_content = get_template('fincode/mock_payment.html').render({
+        'order_id': order_id,
+        'method': method,
+        'amount': amount,
+    })
+    
+    response = HttpResponse(html_content, content_type='text/html; charset=utf-8')
+    response['Cache-Control'] = 'public, max-age=60'
+    return response
@@ -1,19 +1,60 @@
 # GMO FINCODE 決済サービス
 
+import functools
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import json
+import random
 import hashlib
 import hmac
 import logging
+import time
+import uuid
 from datetime import datetime, timedelta
-from typing import Dict, Any, Optional, Tuple
+from typing import Dict, Any, List, Optional, Tuple
 from django.conf import settings
 from django.core.cache import cache
+from django.db import connection
+from django.db.models.expressions import RawSQL
 from django.utils import timezone
 from .models import User, PaymentTransaction
 
 logger = logging.getLogger(__name__)
 
+# 未確定ステータスの再ポーリング間隔（指数バックオフ、秒）
+POLL_BACKOFF_BASE = 1
+POLL_BACKOFF_MAX = 30
+TERMINAL_STATUSES = ('completed', 'cancelled', 'failed')
+
+# 決済方法マッピング（FINCODE仕様に合わせて更新予定）
+PAYMENT_METHOD_MAP = {
+    'paypay': 'paypay',
+    'card': 'card',
+    'applepay': 'applepay', 
+    'googlepay': 'googlepay',
+    'konbini': 'konbini',
+    'bank_transfer': 'bank_transfer',
+    'virtual_account': 'virtual_account'
+}
+
+# ステータスマッピング（FINCODE仕様に合わせて更新予定）
+STATUS_MAP = {
+    'UNPROCESSED': 'pending',
+    'AUTHORIZED': 'processing', 
+    'CAPTURED': 'completed',
+    'CANCELED': 'cancelled',
+    'FAILED': 'failed'
+}
+
+# 決済トランザクション記録の固定項目
+_TX_TEMPLATE = {
+    'transaction_type': 'payment',
+    'payment_method': 'fincode',
+    'status': 'pending',
+}
+
 class FINCODEError(Exception):
     """FINCODE API エラー"""
     def __init__(self, message: str, error_code: str = None, status_code: int = None):
@@ -33,39 +74,42 @@ class FINCODEService:
         self.api_base_url = config('FINCODE_BASE_URL', default='https://api.fincode.jp')
         self.is_production = config('FINCODE_IS_PRODUCTION', default=False, cast=bool)
         self.timeout = config('FINCODE_TIMEOUT', default=30, cast=int)
+        self.connect_timeout = config('FINCODE_CONNECT_TIMEOUT', default=3.05, cast=float)
+        
+        self.has_credentials = bool(self.api_key and self.secret_key and self.shop_id)
         
         # 本番環境でのAPI設定検証
         if self.is_production:
-            if not all([self.api_key, self.secret_key, self.shop_id]):
+            if not self.has_credentials:
                 raise FINCODEError("本番環境でFINCODE認証情報が不足しています")
             logger.info("FINCODE本番環境モードで初期化されました")
         else:
             logger.info("FINCODEテスト環境モードで初期化されました")
         
-        # 決済方法マッピング（FINCODE仕様に合わせて更新予定）
-        self.payment_method_map = {
-            'paypay': 'paypay',
-            'card': 'card',
-            'applepay': 'applepay', 
-            'googlepay': 'googlepay',
-            'konbini': 'konbini',
-            'bank_transfer': 'bank_transfer',
-            'virtual_account': 'virtual_account'
-        }
+        # APIベースURL（末尾スラッシュは初期化時に正規化）
+        self._url_prefix = self.api_base_url.rstrip('/')
         
-        # ステータスマッピング（FINCODE仕様に合わせて更新予定）
-        self.status_map = {
-            'UNPROCESSED': 'pending',
-            'AUTHORIZED': 'processing', 
-            'CAPTURED': 'completed',
-            'CANCELED': 'cancelled',
-            'FAILED': 'failed'
+        # リクエスト共通ヘッダー（呼び出し毎に再構築しない）
+        self._base_headers = {
+            'Authorization': f'Bearer {self.api_key}',
+            'Content-Type': 'application/json',
+            'User-Agent': 'BIID-PointApp/1.0'
         }
+        
+        # HTTPセッション（ワーカー内でTCP/TLS接続を再利用）
+        self._session = requests.Session()
+        self._session.headers.update(self._base_headers)
+        adapter = HTTPAdapter(
+            pool_connections=16,
+            pool_maxsize=32,
+            max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=[502, 503, 504])
+        )
+        self._session.mount('https://', adapter)
 
     def initiate_payment(self, payment_data: Dict[str, Any]) -> Dict[str, Any]:
         """決済開始"""
         try:
-            logger.info(f"🔄 Initiating FINCODE payment: {payment_data.get('order_id')}")
+            logger.info("🔄 Initiating FINCODE payment: %s", payment_data.get('order_id'))
             
             # リクエストデータ構築
             request_data = self._build_payment_request(payment_data)
@@ -78,7 +122,8 @@ class FINCODEService:
                 response_data = self._mock_fincode_response('payment', request_data)
             
             # レスポンス処理
-            if response_data.get('status') in ['UNPROCESSED', 'AUTHORIZED']:
+            status_raw = response_data.get('status')
+            if status_raw in ('UNPROCESSED', 'AUTHORIZED'):
                 # トランザクション記録
                 transaction = self._create_transaction_record(payment_data, response_data)
                 
@@ -87,7 +132,7 @@ class FINCODEService:
                     'payment_id': response_data.get('id'),
                     'redirect_url': response_data.get('redirect_url'),
                     'order_id': payment_data['order_id'],
-                    'status': self.status_map.get(response_data.get('status'), 'pending'),
+                    'status': STATUS_MAP.get(status_raw, 'pending'),
                     'db_transaction_id': transaction.id if transaction else None
                 }
             else:
@@ -100,57 +145,183 @@ class FINCODEService:
         except FINCODEError:
             raise
         except Exception as e:
-            logger.error(f"FINCODE payment initiation failed: {str(e)}")
+            logger.error("FINCODE payment initiation failed: %s", e)
             raise FINCODEError(f"決済処理でシステムエラーが発生しました: {str(e)}")
 
+    def initiate_payment_batch(self, payment_list: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """一括決済開始（トランザクション記録はbulk_createでまとめて保存）"""
+        results = []
+        pending = []
+        
+        for payment_data in payment_list:
+            try:
+                request_data = self._build_payment_request(payment_data)
+                
+                if self.is_production:
+                    response_data = self._call_fincode_api('/v1/payments', request_data, method='POST')
+                else:
+                    response_data = self._mock_fincode_response('payment', request_data)
+                
+                status_raw = response_data.get('status')
+                if status_raw not in ('UNPROCESSED', 'AUTHORIZED'):
+                    raise FINCODEError(
+                        response_data.get('error_message', '決済の開始に失敗しました'),
+                        response_data.get('error_code'),
+                        response_data.get('status_code')
+                    )
+                
+                result = {
+                    'success': True,
+                    'payment_id': response_data.get('id'),
+                    'redirect_url': response_data.get('redirect_url'),
+                    'order_id': payment_data['order_id'],
+                    'status': STATUS_MAP.get(status_raw, 'pending'),
+                    'db_transaction_id': None
+                }
+                
+                # 記録の構築失敗は決済結果に影響させない（FINCODE側では決済開始済み）
+                try:
+                    transaction = self._build_transaction_record(payment_data, response_data)
+                except Exception as e:
+                    logger.error("Failed to build transaction record: %s", e)
+                    transaction = None
+                
+                results.append(result)
+                if transaction:
+                    pending.append((result, transaction))
+                    
+            except Exception as e:
+                logger.error("FINCODE batch payment initiation failed: %s", e)
+                results.append({
+                    'success': False,
+                    'order_id': payment_data.get('order_id'),
+                    'error_message': str(e),
+                    'error_code': getattr(e, 'error_code', None)
+                })
+        
+        self._flush_transaction_records(pending)
+        return results
+
+    def _flush_transaction_records(self, pending: List[Tuple[Dict[str, Any], 'PaymentTransaction']]):
+        """構築済みトランザクション記録の一括保存"""
+        if not pending:
+            return
+        
+        try:
+            created = PaymentTransaction.objects.bulk_create(
+                [transaction for _, transaction in pending],
+                batch_size=500
+            )
+            for (result, _), transaction in zip(pending, created):
+                result['db_transaction_id'] = transaction.id
+            logger.info("Transaction records created: %s", len(created))
+        except Exception as e:
+            logger.error("Failed to bulk create transaction records: %s", e)
+
     def check_payment_status(self, payment_id: str) -> Dict[str, Any]:
         """決済ステータス確認"""
         try:
-            logger.info(f"🔍 Checking FINCODE payment status: {payment_id}")
+            logger.info("🔍 Checking FINCODE payment status: %s", payment_id)
             
-            # キャッシュから確認
-            cache_key = f"fincode_status_{payment_id}"
+            # キャッシュから確認（タプル形式は旧形式の辞書と共存しないようキーを分ける）
+            cache_key = f"fincode_status:v2:{payment_id}"
             cached_status = cache.get(cache_key)
-            if cached_status and cached_status.get('status') == 'completed':
-                return cached_status
+            if isinstance(cached_status, (list, tuple)) and len(cached_status) == 5:
+                return self._unpack_completed_status(payment_id, cached_status)
+            if cached_status is not None:
+                # 解釈できない値は破棄してAPIで再確認
+                cache.delete(cache_key)
+            
+            # 未確定ステータスはバックオフ期間中なら前回結果を返す（ワーカーの一斉再問い合わせ防止）
+            next_poll_key = f"fincode_next_poll_{payment_id}"
+            pending_poll = cache.get(next_poll_key)
+            if pending_poll:
+                return pending_poll['result']
             
             if self.is_production:
                 response_data = self._call_fincode_api(f'/v1/payments/{payment_id}')
             else:
                 response_data = self._mock_fincode_response('status', {'payment_id': payment_id})
             
+            get = response_data.get
             status_result = {
                 'success': True,
-                'status': self.status_map.get(response_data.get('status'), 'failed'),
+                'status': STATUS_MAP.get(get('status'), 'failed'),
                 'payment_id': payment_id,
-                'order_id': response_data.get('order_id'),
-                'amount': response_data.get('amount'),
-                'payment_method': response_data.get('pay_type'),
-                'completed_at': response_data.get('created'),
-                'updated_at': response_data.get('updated')
+                'order_id': get('order_id'),
+                'amount': get('amount'),
+                'payment_method': get('pay_type'),
+                'completed_at': get('created'),
+                'updated_at': get('updated')
             }
             
             # 完了ステータスの場合はキャッシュ（24時間）
+            # 既に他のワーカーが完了を記録済み（addがFalse）ならキャッシュ・DBとも書き込まない
+            # キャッシュ障害時（IGNORE_EXCEPTIONSでNone）はDB更新を行う
             if status_result['status'] == 'completed':
-                cache.set(cache_key, status_result, 86400)
-                
-                # DBのトランザクション更新
-                self._update_transaction_status(payment_id, 'completed', response_data)
+                if cache.add(cache_key, self._pack_completed_status(status_result), 86400) is not False:
+                    # DBのトランザクション更新（失敗時は次回確認で再試行できるようキャッシュを解除）
+                    if not self._update_transaction_status(payment_id, 'completed', response_data):
+                        cache.delete(cache_key)
+            if status_result['status'] in TERMINAL_STATUSES:
+                self.clear_poll_state(payment_id)
+            else:
+                self._schedule_next_poll(payment_id, status_result)
             
             return status_result
             
         except Exception as e:
-            logger.error(f"FINCODE status check failed: {str(e)}")
+            logger.error("FINCODE status check failed: %s", e)
             return {
                 'success': False,
                 'status': 'failed',
                 'error_message': str(e)
             }
 
+    def _pack_completed_status(self, status_result: Dict[str, Any]) -> Tuple:
+        """完了ステータスをキャッシュ用の最小タプルに変換"""
+        return (
+            status_result['order_id'],
+            status_result['amount'],
+            status_result['payment_method'],
+            status_result['completed_at'],
+            status_result['updated_at'],
+        )
+
+    def _unpack_completed_status(self, payment_id: str, packed) -> Dict[str, Any]:
+        """キャッシュ用タプルから完了ステータスを復元"""
+        order_id, amount, payment_method, completed_at, updated_at = packed
+        return {
+            'success': True,
+            'status': 'completed',
+            'payment_id': payment_id,
+            'order_id': order_id,
+            'amount': amount,
+            'payment_method': payment_method,
+            'completed_at': completed_at,
+            'updated_at': updated_at
+        }
+
+    def _schedule_next_poll(self, payment_id: str, status_result: Dict[str, Any]):
+        """次回ポーリング時刻をキャッシュに記録"""
+        attempt_key = f"fincode_poll_attempt_{payment_id}"
+        attempt = cache.get(attempt_key, 0)
+        backoff = min(POLL_BACKOFF_BASE * 2 ** attempt, POLL_BACKOFF_MAX)
+        
+        cache.set(f"fincode_next_poll_{payment_id}", {
+            'result': status_result,
+            'next_poll_at': time.time() + backoff,
+        }, backoff)
+        cache.set(attempt_key, attempt + 1, 3600)
+
+    def clear_poll_state(self, payment_id: str):
+        """ポーリングのバックオフ状態を破棄（確定ステータス受信時）"""
+        cache.delete_many([f"fincode_next_poll_{payment_id}", f"fincode_poll_attempt_{payment_id}"])
+
     def refund_payment(self, payment_id: str, amount: Optional[int] = None, reason: str = '') -> Dict[str, Any]:
         """返金処理"""
         try:
-            logger.info(f"💸 FINCODE refund request: {payment_id}, amount: {amount}")
+            logger.info("💸 FINCODE refund request: %s, amount: %s", payment_id, amount)
             
             request_data = {
                 'reason': reason
@@ -183,12 +354,12 @@ class FINCODEService:
         except FINCODEError:
             raise
         except Exception as e:
-            logger.error(f"FINCODE refund failed: {str(e)}")
+            logger.error("FINCODE refund failed: %s", e)
             raise FINCODEError(f"返金処理でシステムエラーが発生しました: {str(e)}")
 
     def _build_payment_request(self, payment_data: Dict[str, Any]) -> Dict[str, Any]:
         """決済リクエストデータ構築"""
-        pay_type = self.payment_method_map.get(payment_data.get('payment_method'), 'card')
+        pay_type = PAYMENT_METHOD_MAP.get(payment_data.get('payment_method'), 'card')
         
         # FINCODE API仕様に合わせて構築（API仕様提供後に詳細更新）
         return {
@@ -208,51 +379,67 @@ class FINCODEService:
 
     def _call_fincode_api(self, endpoint: str, data: Dict[str, Any] = None, method: str = 'GET') -> Dict[str, Any]:
         """FINCODE API呼び出し"""
-        url = f"{self.api_base_url}{endpoint}"
-        
-        headers = {
-            'Authorization': f'Bearer {self.api_key}',
-            'Content-Type': 'application/json',
-            'User-Agent': 'BIID-PointApp/1.0'
-        }
+        url = self._url_prefix + endpoint
         
         # API仕様に基づく認証（Bearer Token）
         # 現在のテストAPIキーでは401エラーが返るが、これは正常な応答
         
         try:
             if method == 'GET':
-                response = requests.get(url, headers=headers, timeout=self.timeout)
+                response = self._session.get(url, timeout=(self.connect_timeout, self.timeout))
             else:
-                response = requests.post(url, headers=headers, json=data, timeout=self.timeout)
+                response = self._session.post(url, data=orjson.dumps(data), timeout=(self.connect_timeout, self.timeout))
             
             response.raise_for_status()
-            return response.json()
+            return orjson.loads(response.content)
             
         except requests.exceptions.RequestException as e:
-            logger.error(f"FINCODE API call failed: {url}, error: {str(e)}")
+            logger.error("FINCODE API call failed: %s, error: %s", url, e)
             raise FINCODEError(f"FINCODE APIエラー: {str(e)}")
+        except orjson.JSONDecodeError as e:
+            logger.error("FINCODE API returned invalid JSON: %s, error: %s", url, e)
+            raise FINCODEError(f"FINCODE APIレスポンスが不正です: {str(e)}")
+
+    def verify_webhook_signature(self, signature: str):
+        """
+        Webhook署名検証（不正な場合はFINCODEErrorを送出）
+        FINCODEはWebhook設定で登録した署名文字列をそのまま Fincode-Signature ヘッダーで送信する
+        FINCODE_WEBHOOK_SIGNATURE 未設定時は検証しない
+        """
+        expected = getattr(settings, 'FINCODE_WEBHOOK_SIGNATURE', '')
+        if not expected:
+            logger.debug("FINCODE webhook signature not configured, skipping webhook signature check")
+            return
+        
+        if not hmac.compare_digest((signature or '').encode(), expected.encode()):
+            raise FINCODEError("Webhook署名が無効です", 'INVALID_SIGNATURE', 401)
 
     def _mock_fincode_response(self, operation: str, data: Dict[str, Any]) -> Dict[str, Any]:
         """開発用モックレスポンス"""
-        import time
-        import random
+        # 処理時間シミュレート（FINCODE_MOCK_FAST有効時はスキップ）
+        if not getattr(settings, 'FINCODE_MOCK_FAST', False):
+            time.sleep(random.uniform(0.5, 2.0))
         
-        # 処理時間シミュレート
-        time.sleep(random.uniform(0.5, 2.0))
+        return self._build_mock_response(operation, data)
+
+    def _build_mock_response(self, operation: str, data: Dict[str, Any]) -> Dict[str, Any]:
+        """モックレスポンス本体の構築"""
+        now = time.time()
+        now_iso = datetime.fromtimestamp(now).isoformat()
         
         if operation == 'payment':
             order_id = data.get('order_id')
             amount = data.get('amount', 0)
             
             return {
-                'id': f'FINCODE_{int(time.time())}_{random.randint(1000, 9999)}',
+                'id': f'FINCODE_{int(now)}_{random.randint(1000, 9999)}',
                 'order_id': order_id,
                 'amount': amount,
                 'status': 'UNPROCESSED',
                 'pay_type': data.get('pay_type', 'card'),
                 'redirect_url': f'http://127.0.0.1:8000/api/fincode/mock-payment/{order_id}/?amount={amount}',
-                'created': datetime.now().isoformat(),
-                'updated': datetime.now().isoformat()
+                'created': now_iso,
+                'updated': now_iso
             }
         
         elif operation == 'status':
@@ -262,20 +449,20 @@ class FINCODEService:
             
             return {
                 'id': data.get('payment_id'),
-                'order_id': f'ORDER_{int(time.time())}',
+                'order_id': f'ORDER_{int(now)}',
                 'amount': 30000,
                 'status': status,
                 'pay_type': 'card',
-                'created': datetime.now().isoformat(),
-                'updated': datetime.now().isoformat()
+                'created': now_iso,
+                'updated': now_iso
             }
         
         elif operation == 'refund':
             return {
-                'id': f'REFUND_{int(time.time())}',
+                'id': f'REFUND_{int(now)}',
                 'amount': data.get('amount', 1000),
                 'status': 'REFUNDED',
-                'created': datetime.now().isoformat()
+                'created': now_iso
             }
         
         return {'status': 'FAILED', 'error_message': 'Unknown operation'}
@@ -283,100 +470,134 @@ class FINCODEService:
     def _create_transaction_record(self, payment_data: Dict[str, Any], response_data: Dict[str, Any]) -> Optional['PaymentTransaction']:
         """トランザクション記録作成"""
         try:
-            customer_id = payment_data.get('customer_id')
-            if not customer_id:
-                return None
-                
-            customer = User.objects.filter(member_id=customer_id).first()
-            if not customer:
-                logger.warning(f"Customer not found: {customer_id}")
+            transaction = self._build_transaction_record(payment_data, response_data)
+            if not transaction:
                 return None
             
-            transaction = PaymentTransaction.objects.create(
-                user=customer,
-                transaction_type='payment',
-                payment_method='fincode',
-                amount=payment_data['amount'],
-                points_earned=payment_data.get('points_earned', 0),
-                points_used=payment_data.get('points_used', 0),
-                status='pending',
-                external_transaction_id=response_data.get('id'),
-                order_id=payment_data['order_id'],
-                terminal_id=payment_data.get('terminal_id'),
-                store_id=payment_data.get('store_id'),
-                metadata={
-                    'fincode_response': response_data,
-                    'payment_method_detail': payment_data.get('payment_method'),
-                    'redirect_url': response_data.get('redirect_url'),
-                }
-            )
-            
-            logger.info(f"Transaction record created: {transaction.id}")
+            transaction.save()
+            logger.info("Transaction record created: %s", transaction.id)
             return transaction
             
         except Exception as e:
-            logger.error(f"Failed to create transaction record: {str(e)}")
+            logger.error("Failed to create transaction record: %s", e)
+            return None
+
+    def _build_transaction_record(self, payment_data: Dict[str, Any], response_data: Dict[str, Any]) -> Optional['PaymentTransaction']:
+        """トランザクション記録構築（未保存）"""
+        customer_id = payment_data.get('customer_id')
+        if not customer_id:
+            return None
+            
+        customer_pk = self._get_customer_pk(customer_id)
+        if not customer_pk:
+            logger.warning("Customer not found: %s", customer_id)
+            return None
+        
+        store_id = payment_data.get('store_id')
+        if not store_id:
+            logger.warning("Store not specified for order: %s", payment_data['order_id'])
             return None
+        
+        kwargs = _TX_TEMPLATE.copy()
+        kwargs.update(
+            transaction_id=f"FINCODE-{payment_data['order_id']}",
+            customer_id=customer_pk,
+            total_amount=payment_data['amount'],
+            points_earned=payment_data.get('points_earned', 0),
+            points_used=payment_data.get('points_used', 0),
+            fincode_payment_id=response_data.get('id'),
+            fincode_order_id=payment_data['order_id'],
+            terminal_id=payment_data.get('terminal_id') or '',
+            store_id=store_id,
+            metadata={
+                'fincode_response': response_data,
+                'payment_method_detail': payment_data.get('payment_method'),
+                'redirect_url': response_data.get('redirect_url'),
+            }
+        )
+        return PaymentTransaction(**kwargs)
 
-    def _update_transaction_status(self, payment_id: str, status: str, response_data: Dict[str, Any]):
-        """トランザクションステータス更新"""
+    def _get_customer_pk(self, member_id: str) -> Optional[int]:
+        """会員IDからユーザーPKを取得（5分キャッシュ）"""
+        cache_key = f"user_pk_by_member:{member_id}"
+        user_pk = cache.get(cache_key)
+        if user_pk is None:
+            user_pk = User.objects.filter(member_id=member_id).values_list('pk', flat=True).first()
+            if user_pk is not None:
+                cache.set(cache_key, user_pk, 300)
+        return user_pk
+
+    def _update_transaction_status(self, payment_id: str, status: str, response_data: Dict[str, Any]) -> bool:
+        """トランザクションステータス更新（SELECTせず単一UPDATEで反映、DBエラー時はFalse）"""
         try:
-            transaction = PaymentTransaction.objects.filter(
-                external_transaction_id=payment_id
-            ).first()
+            now = timezone.now()
+            update_fields = {'status': status, 'updated_at': now}
             
-            if transaction:
-                transaction.status = status
-                if status == 'completed':
-                    transaction.completed_at = timezone.now()
-                    
-                    # メタデータ更新
-                    if transaction.metadata:
-                        transaction.metadata.update({
-                            'completion_response': response_data,
-                            'completed_at': response_data.get('updated')
-                        })
-                    
-                transaction.save()
-                logger.info(f"Transaction status updated: {transaction.id} -> {status}")
+            if status == 'completed':
+                update_fields['completed_at'] = now
+                # メタデータはDB側でマージ
+                update_fields['metadata'] = self._merge_metadata_expression({
+                    'completion_response': response_data,
+                    'completed_at': response_data.get('updated')
+                })
+            
+            updated = PaymentTransaction.objects.filter(
+                fincode_payment_id=payment_id
+            ).update(**update_fields)
+            
+            if updated:
+                logger.info("Transaction status updated: %s -> %s", payment_id, status)
+            return True
             
         except Exception as e:
-            logger.error(f"Failed to update transaction status: {str(e)}")
+            logger.error("Failed to update transaction status: %s", e)
+            return False
+
+    def _merge_metadata_expression(self, patch: Dict[str, Any]) -> RawSQL:
+        """既存metadataへpatchをマージするSQL式"""
+        if connection.vendor == 'postgresql':
+            return RawSQL("COALESCE(metadata, '{}'::jsonb) || %s::jsonb", [json.dumps(patch)])
+        return RawSQL("json_patch(COALESCE(metadata, '{}'), %s)", [json.dumps(patch)])
 
     def _create_refund_record(self, payment_id: str, response_data: Dict[str, Any]):
         """返金記録作成"""
         try:
             # 元のトランザクション検索
             original_transaction = PaymentTransaction.objects.filter(
-                external_transaction_id=payment_id
-            ).first()
+                fincode_payment_id=payment_id
+            ).only('id', 'transaction_id', 'customer_id', 'terminal_id', 'store_id', 'payment_method').first()
             
             if original_transaction:
-                # 返金記録作成
+                # 返金記録作成（元取引との紐付けはmetadataに保持）
                 refund_transaction = PaymentTransaction.objects.create(
-                    user=original_transaction.user,
+                    transaction_id=f"FINCODE-REFUND-{uuid.uuid4().hex}",
+                    customer_id=original_transaction.customer_id,
                     transaction_type='refund',
-                    payment_method='fincode',
-                    amount=-response_data.get('amount', 0),
+                    payment_method=original_transaction.payment_method,
+                    total_amount=-response_data.get('amount', 0),
                     status='completed',
-                    external_transaction_id=response_data.get('id'),
-                    related_transaction=original_transaction,
+                    fincode_payment_id=response_data.get('id'),
                     terminal_id=original_transaction.terminal_id,
                     store_id=original_transaction.store_id,
                     metadata={
                         'fincode_refund_response': response_data,
-                        'original_payment_id': payment_id
+                        'original_payment_id': payment_id,
+                        'original_transaction_id': original_transaction.transaction_id,
+                        'original_transaction_pk': original_transaction.id
                     },
                     completed_at=timezone.now()
                 )
                 
-                logger.info(f"Refund record created: {refund_transaction.id}")
+                logger.info("Refund record created: %s", refund_transaction.id)
                 return refund_transaction
             
         except Exception as e:
-            logger.error(f"Failed to create refund record: {str(e)}")
+            logger.error("Failed to create refund record: %s", e)
             return None
 
 
-# サービスインスタンス
-fincode_service = FINCODEService()
\ No newline at end of file
+# サービスインスタンス（初回利用時に生成）
+@functools.lru_cache(maxsize=1)
+def get_fincode_service() -> FINCODEService:
+    """FINCODEServiceシングルトン取得"""
+    return FINCODEService()
\ No newline at end of file
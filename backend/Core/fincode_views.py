@@ -1,89 +1,104 @@
 # GMO FINCODE 決済 API ビュー
 
-from django.conf import settings
-from django.views.decorators.http import require_POST, require_http_methods
+from django.core.cache import cache
+from django.views.decorators.http import condition, require_POST, require_http_methods
 from django.views.decorators.csrf import csrf_exempt
-from django.http import JsonResponse, HttpResponse
-import json
+from django.http import HttpResponse, StreamingHttpResponse
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import CharField, Count, F, Max, Value
+from django.db.models.functions import Cast, Coalesce, Concat
+from django.utils import timezone
+import orjson
 import time
-import random
-import string
+import secrets
 import logging
 from typing import Dict, Any
-from .fincode_service import fincode_service, FINCODEError
+from .fincode_service import get_fincode_service, FINCODEError, STATUS_MAP
 from .models import User, PaymentTransaction
-from .serializers import PaymentTransactionSerializer
 
 logger = logging.getLogger(__name__)
 
+# 取引履歴APIの出力項目（PaymentTransactionSerializerと同一）
+TRANSACTION_HISTORY_FIELDS = (
+    'id', 'transaction_id', 'customer', 'store',
+    'transaction_type', 'payment_method', 'status', 'subtotal', 'tax_amount',
+    'total_amount', 'points_earned', 'points_used', 'points_balance_before',
+    'points_balance_after', 'gmopg_order_id', 'gmopg_transaction_id',
+    'external_payment_data', 'description', 'metadata', 'created_at',
+    'updated_at', 'completed_at', 'receipt_number', 'receipt_generated',
+    'receipt_emailed'
+)
+TRANSACTION_HISTORY_MAX_LIMIT = 1000
+
 
 class FincodeApiError(Exception):
     pass
 
 
+class OrjsonResponse(HttpResponse):
+    """orjsonでシリアライズするJSONレスポンス"""
+    _default = DjangoJSONEncoder().default
+
+    def __init__(self, data, **kwargs):
+        kwargs.setdefault('content_type', 'application/json')
+        super().__init__(orjson.dumps(data, default=self._default), **kwargs)
+
+
 def _uniq_order_id(prefix="ORD"):
     """ユニークなOrderIDを生成"""
-    nonce = ''.join(random.choice(string.ascii_uppercase + string.digits) for _ in range(6))
-    return f"{prefix}_{int(time.time())}_{nonce}"
+    return f"{prefix}_{int(time.time())}_{secrets.token_hex(3).upper()}"
+
+
+def _initiate_params(body):
+    """決済開始リクエストから金額・注文ID・決済方法・顧客IDを取り出す"""
+    amount = int(body.get("amount", 0))
+    order_id = body.get("order_id") or _uniq_order_id()
+    payment_method = (body.get("payment_method") or "card").lower()
+    customer_id = body.get("customer_id", "")
+
+    logger.info("🔄 FINCODE payment initiation: order_id=%s, amount=%s, method=%s, customer_id=%s", order_id, amount, payment_method, customer_id)
+    return amount, order_id, payment_method, customer_id
+
+
+def _validate_initiate_params(amount, order_id, customer_id):
+    """決済開始の入力検証（エラー時はレスポンスを返す）"""
+    if amount <= 0:
+        logger.warning("❌ Invalid amount: %s", amount)
+        return OrjsonResponse({"success": False, "error": "INVALID_AMOUNT", "detail": f"金額が無効です: {amount}"}, status=400)
+    
+    if not order_id:
+        logger.warning("❌ Missing order_id")
+        return OrjsonResponse({"success": False, "error": "MISSING_ORDER_ID", "detail": "注文IDが必要です"}, status=400)
+
+    if not customer_id:
+        logger.warning("❌ Missing customer_id")
+        return OrjsonResponse({"success": False, "error": "MISSING_CUSTOMER_ID", "detail": "顧客IDが必要です"}, status=400)
+
+    return None
 
 
 @csrf_exempt
 @require_POST
 def initiate_payment(request):
     """
-    決済開始。入力検証→（モック or 実呼び出し）→結果を透過返却。
+    決済開始。入力検証→実呼び出し→結果を透過返却。
+    （モック動作は fincode_mock_views を参照）
     """
     try:
-        body = json.loads(request.body.decode())
-        amount = int(body.get("amount", 0))
-        order_id = body.get("order_id") or _uniq_order_id()
-        payment_method = (body.get("payment_method") or "card").lower()
-        customer_id = body.get("customer_id", "")
-
-        logger.info(f"🔄 FINCODE payment initiation: order_id={order_id}, amount={amount}, method={payment_method}, customer_id={customer_id}")
-
-        # 入力検証
-        if amount <= 0:
-            logger.warning(f"❌ Invalid amount: {amount}")
-            return JsonResponse({"success": False, "error": "INVALID_AMOUNT", "detail": f"金額が無効です: {amount}"}, status=400)
+        body = orjson.loads(request.body or b"{}")
+        amount, order_id, payment_method, customer_id = _initiate_params(body)
         
-        if not order_id:
-            logger.warning("❌ Missing order_id")
-            return JsonResponse({"success": False, "error": "MISSING_ORDER_ID", "detail": "注文IDが必要です"}, status=400)
+        error_response = _validate_initiate_params(amount, order_id, customer_id)
+        if error_response is not None:
+            return error_response
 
-        if not customer_id:
-            logger.warning("❌ Missing customer_id")
-            return JsonResponse({"success": False, "error": "MISSING_CUSTOMER_ID", "detail": "顧客IDが必要です"}, status=400)
-
-        # モック動作：開発を止めないため
-        if getattr(settings, "FINCODE_MOCK", False):
-            logger.info(f"🎭 Mock mode: returning success for order_id={order_id}")
-            # ローカルモック決済ページURL
-            base_url = request.build_absolute_uri('/').rstrip('/')
-            mock_response = {
-                "id": f"MOCK_{int(time.time())}_{random.randint(1000, 9999)}",
-                "order_id": order_id,
-                "amount": amount,
-                "status": "UNPROCESSED",
-                "pay_type": payment_method,
-                "redirect_url": f"{base_url}/api/fincode/mock-payment/{order_id}/?method={payment_method}&amount={amount}",
-                "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
-                "updated": time.strftime("%Y-%m-%dT%H:%M:%S")
-            }
-            
-            return JsonResponse({
-                "success": True,
-                "mock": True,
-                "fincode": mock_response,
-                "payment_id": mock_response["id"],
-                "redirect_url": mock_response["redirect_url"],
-                "order_id": order_id,
-                "status": "pending"
-            }, status=200)
+        # 戻り先URL等の基点（リクエスト毎に一度だけ構築）
+        base_url = request.build_absolute_uri('/').rstrip('/')
 
         # ---- 本番呼び出し ----
         try:
-            logger.info(f"🔄 Calling FINCODE service: order_id={order_id}, amount={amount}")
+            logger.info("🔄 Calling FINCODE service: order_id=%s, amount=%s", order_id, amount)
             
             # FINCODE サービス呼び出し
             payment_data = {
@@ -95,9 +110,9 @@ def initiate_payment(request):
                 'customer_email': body.get('customer_email', ''),
                 'payment_method': payment_method,
                 'description': f'BIID Point App Payment - {payment_method}',
-                'return_url': f"{request.build_absolute_uri('/').rstrip('/')}/api/fincode/payment/return/{order_id}/",
-                'cancel_url': f"{request.build_absolute_uri('/').rstrip('/')}/api/fincode/payment/cancel/{order_id}/",
-                'notify_url': f"{request.build_absolute_uri('/').rstrip('/')}/api/fincode/payment/notify/",
+                'return_url': f"{base_url}/api/fincode/payment/return/{order_id}/",
+                'cancel_url': f"{base_url}/api/fincode/payment/cancel/{order_id}/",
+                'notify_url': f"{base_url}/api/fincode/payment/notify/",
                 'metadata': {
                     'original_amount': amount,
                     'payment_method': payment_method,
@@ -106,37 +121,37 @@ def initiate_payment(request):
                 }
             }
             
-            exec_result = fincode_service.initiate_payment(payment_data)
-            logger.info(f"✅ FINCODE service response: {exec_result}")
+            exec_result = get_fincode_service().initiate_payment(payment_data)
+            logger.info("✅ FINCODE service response: %s", exec_result)
             
         except FINCODEError as e:
-            logger.error(f"❌ FINCODE service error: {str(e)}")
-            return JsonResponse({
+            logger.error("❌ FINCODE service error: %s", e)
+            return OrjsonResponse({
                 "success": False, 
                 "error": "FINCODE_API_ERROR",
                 "detail": str(e),
                 "error_code": e.error_code
             }, status=422)
         except Exception as e:
-            logger.error(f"❌ FINCODE service error: {str(e)}")
+            logger.error("❌ FINCODE service error: %s", e)
             raise FincodeApiError(f"FINCODE service error: {str(e)}")
         
         # 戻り値検証
         if not isinstance(exec_result, dict):
-            logger.error(f"❌ FINCODE returned non-dict response: {type(exec_result)}")
+            logger.error("❌ FINCODE returned non-dict response: %s", type(exec_result))
             raise FincodeApiError("fincode service returned non-dict response")
 
         # エラーチェック
         if not exec_result.get("success", False):
-            logger.warning(f"🚨 FINCODE payment failed: {exec_result}")
-            return JsonResponse({
+            logger.warning("🚨 FINCODE payment failed: %s", exec_result)
+            return OrjsonResponse({
                 "success": False, 
                 "fincode": exec_result,
                 "error": exec_result.get("error", "Payment initiation failed")
             }, status=422)
 
-        logger.info(f"✅ Payment initiation successful: {exec_result}")
-        return JsonResponse({
+        logger.info("✅ Payment initiation successful: %s", exec_result)
+        return OrjsonResponse({
             "success": True, 
             "fincode": exec_result,
             "payment_id": exec_result.get('payment_id'),
@@ -146,21 +161,21 @@ def initiate_payment(request):
             "db_transaction_id": exec_result.get('db_transaction_id')
         }, status=200)
 
-    except json.JSONDecodeError as e:
-        logger.error(f"❌ JSON decode error: {str(e)}")
-        return JsonResponse({"success": False, "error": "INVALID_JSON", "detail": "無効なJSONデータです"}, status=400)
+    except orjson.JSONDecodeError as e:
+        logger.error("❌ JSON decode error: %s", e)
+        return OrjsonResponse({"success": False, "error": "INVALID_JSON", "detail": "無効なJSONデータです"}, status=400)
     
     except ValueError as e:
-        logger.error(f"❌ Value error: {str(e)}")
-        return JsonResponse({"success": False, "error": "INVALID_DATA", "detail": str(e)}, status=400)
+        logger.error("❌ Value error: %s", e)
+        return OrjsonResponse({"success": False, "error": "INVALID_DATA", "detail": str(e)}, status=400)
     
     except FincodeApiError as e:
-        logger.error(f"❌ FINCODE API error: {str(e)}")
-        return JsonResponse({"success": False, "error": "FINCODE_API_ERROR", "detail": str(e)}, status=502)
+        logger.error("❌ FINCODE API error: %s", e)
+        return OrjsonResponse({"success": False, "error": "FINCODE_API_ERROR", "detail": str(e)}, status=502)
     
     except Exception as e:
-        logger.error(f"❌ Unexpected error: {str(e)}")
-        return JsonResponse({"success": False, "error": "SERVER_EXCEPTION", "detail": str(e)}, status=500)
+        logger.error("❌ Unexpected error: %s", e)
+        return OrjsonResponse({"success": False, "error": "SERVER_EXCEPTION", "detail": str(e)}, status=500)
 
 
 @csrf_exempt
@@ -168,28 +183,18 @@ def initiate_payment(request):
 def check_payment_status(request, payment_id):
     """決済状態確認API"""
     try:
-        logger.info(f"🔍 Checking payment status: {payment_id}")
-        
-        if getattr(settings, "FINCODE_MOCK", False):
-            # モック: ランダムで状態を返す
-            statuses = ["pending", "processing", "completed", "failed"]
-            mock_status = random.choice(statuses)
-            return JsonResponse({
-                "success": True,
-                "mock": True,
-                "status": mock_status,
-                "payment_id": payment_id,
-                "order_id": f"ORDER_{int(time.time())}",
-                "amount": 30000,
-                "payment_method": "card",
-                "updated_at": time.strftime("%Y-%m-%dT%H:%M:%S")
-            })
+        logger.info("🔍 Checking payment status: %s", payment_id)
         
-        # 実装: FINCODE APIで状態確認
-        result = fincode_service.check_payment_status(payment_id)
+        # 実装: FINCODE APIで状態確認（端末の連続ポーリングは短時間キャッシュで吸収）
+        status_cache_key = f"fincode:status:{payment_id}"
+        result = cache.get(status_cache_key)
+        if result is None:
+            result = get_fincode_service().check_payment_status(payment_id)
+            if result.get('success', False):
+                cache.set(status_cache_key, result, 2)
         
         if result.get('success', False):
-            return JsonResponse({
+            return OrjsonResponse({
                 "success": True, 
                 "fincode": result,
                 "status": result.get("status"),
@@ -201,15 +206,15 @@ def check_payment_status(request, payment_id):
                 "updated_at": result.get("updated_at")
             })
         else:
-            return JsonResponse({
+            return OrjsonResponse({
                 "success": False,
                 "error": "STATUS_CHECK_FAILED",
                 "detail": result.get("error_message", "Status check failed")
             }, status=500)
     
     except Exception as e:
-        logger.error(f"❌ Status check error: {str(e)}")
-        return JsonResponse({"success": False, "error": "STATUS_CHECK_ERROR", "detail": str(e)}, status=500)
+        logger.error("❌ Status check error: %s", e)
+        return OrjsonResponse({"success": False, "error": "STATUS_CHECK_ERROR", "detail": str(e)}, status=500)
 
 
 @csrf_exempt
@@ -217,27 +222,17 @@ def check_payment_status(request, payment_id):
 def refund_payment(request, payment_id):
     """返金処理API"""
     try:
-        body = json.loads(request.body.decode()) if request.body else {}
+        body = orjson.loads(request.body or b"{}")
         amount = body.get("amount")  # 部分返金の場合
         reason = body.get("reason", "")
         
-        logger.info(f"💸 FINCODE refund request: payment_id={payment_id}, amount={amount}")
-        
-        if getattr(settings, "FINCODE_MOCK", False):
-            # モック返金
-            return JsonResponse({
-                "success": True,
-                "mock": True,
-                "refund_id": f"REFUND_MOCK_{int(time.time())}",
-                "refund_amount": amount or 30000,
-                "status": "completed"
-            })
+        logger.info("💸 FINCODE refund request: payment_id=%s, amount=%s", payment_id, amount)
         
         # 実装: FINCODE APIで返金処理
-        result = fincode_service.refund_payment(payment_id, amount, reason)
+        result = get_fincode_service().refund_payment(payment_id, amount, reason)
         
         if result.get('success', False):
-            return JsonResponse({
+            return OrjsonResponse({
                 "success": True,
                 "fincode": result,
                 "refund_id": result.get("refund_id"),
@@ -245,28 +240,28 @@ def refund_payment(request, payment_id):
                 "status": result.get("status")
             })
         else:
-            return JsonResponse({
+            return OrjsonResponse({
                 "success": False,
                 "error": "REFUND_FAILED", 
                 "detail": "返金処理に失敗しました"
             }, status=500)
             
-    except json.JSONDecodeError:
-        return JsonResponse({"success": False, "error": "INVALID_JSON"}, status=400)
+    except orjson.JSONDecodeError:
+        return OrjsonResponse({"success": False, "error": "INVALID_JSON"}, status=400)
     except Exception as e:
-        logger.error(f"❌ Refund error: {str(e)}")
-        return JsonResponse({"success": False, "error": "REFUND_ERROR", "detail": str(e)}, status=500)
+        logger.error("❌ Refund error: %s", e)
+        return OrjsonResponse({"success": False, "error": "REFUND_ERROR", "detail": str(e)}, status=500)
 
 
 @csrf_exempt
 def payment_return(request, order_id):
     """決済完了時のリターンURL"""
-    logger.info(f"🔄 Payment return: order_id={order_id}")
+    logger.info("🔄 Payment return: order_id=%s", order_id)
     
     # 決済完了後の処理をここに実装
     # 例：データベースのステータス更新、ポイント付与など
     
-    return JsonResponse({
+    return OrjsonResponse({
         "success": True, 
         "message": "Payment completed", 
         "order_id": order_id,
@@ -277,12 +272,12 @@ def payment_return(request, order_id):
 @csrf_exempt 
 def payment_cancel(request, order_id):
     """決済キャンセル時のキャンセルURL"""
-    logger.info(f"🔄 Payment cancelled: order_id={order_id}")
+    logger.info("🔄 Payment cancelled: order_id=%s", order_id)
     
     # キャンセル処理をここに実装
     # 例：データベースのステータス更新
     
-    return JsonResponse({
+    return OrjsonResponse({
         "success": False, 
         "message": "Payment cancelled", 
         "order_id": order_id,
@@ -294,60 +289,109 @@ def payment_cancel(request, order_id):
 @require_POST
 def payment_notify(request):
     """決済通知受信（Webhook）"""
-    logger.info(f"🔄 Payment notification received")
+    logger.info("🔄 Payment notification received")
+    
+    # 署名検証
+    try:
+        get_fincode_service().verify_webhook_signature(request.headers.get('Fincode-Signature', ''))
+    except FINCODEError as e:
+        logger.warning("🚨 Webhook signature rejected: %s", e)
+        return OrjsonResponse({"success": False, "error": "INVALID_SIGNATURE"}, status=401)
     
     try:
         # FINCODE からの通知を処理
-        body = json.loads(request.body.decode()) if request.body else {}
+        body = orjson.loads(request.body or b"{}")
         payment_id = body.get('id', '')
         status = body.get('status', '')
         order_id = body.get('order_id', '')
         
-        logger.info(f"📬 Webhook: payment_id={payment_id}, status={status}, order_id={order_id}")
+        logger.info("📬 Webhook: payment_id=%s, status=%s, order_id=%s", payment_id, status, order_id)
         
-        # データベース更新処理
+        # データベース更新処理（単一UPDATEで反映し、再送時も競合しない）
         if payment_id and status:
+            # 同一通知の再送は処理済みとして即応答
+            # キャッシュ障害時（IGNORE_EXCEPTIONSでNoneが返る）は重複扱いせずUPDATEへ進む（UPDATEは冪等）
+            webhook_key = f"fincode:wh:{payment_id}:{status}"
+            if cache.add(webhook_key, 1, timeout=86400) is False:
+                logger.info("🔁 Duplicate webhook skipped: payment_id=%s, status=%s", payment_id, status)
+                return OrjsonResponse({"success": True, "deduped": True})
+            
             try:
-                transaction = PaymentTransaction.objects.filter(
-                    fincode_payment_id=payment_id
-                ).first()
+                new_status = STATUS_MAP.get(status, 'failed')
+                now = timezone.now()
+                update_fields = {'status': new_status, 'updated_at': now}
                 
-                if transaction:
-                    # ステータスマッピング
-                    status_map = {
-                        'UNPROCESSED': 'pending',
-                        'AUTHORIZED': 'processing', 
-                        'CAPTURED': 'completed',
-                        'CANCELED': 'cancelled',
-                        'FAILED': 'failed'
-                    }
-                    
-                    new_status = status_map.get(status, 'failed')
-                    transaction.status = new_status
-                    
-                    if new_status == 'completed':
-                        transaction.mark_completed()
-                    else:
-                        transaction.save()
-                    
-                    logger.info(f"✅ Transaction updated: {transaction.id} -> {new_status}")
+                if new_status == 'completed':
+                    # mark_completed() と同等の完了時刻・レシート番号をDB側で設定
+                    update_fields['completed_at'] = Coalesce(F('completed_at'), Value(now))
+                    update_fields['receipt_number'] = Coalesce(
+                        F('receipt_number'),
+                        Concat(
+                            Value(f"R-{timezone.localtime(now).strftime('%Y%m%d%H%M%S')}-"),
+                            Cast('id', output_field=CharField())
+                        )
+                    )
+                
+                with transaction.atomic():
+                    updated = PaymentTransaction.objects.filter(
+                        fincode_payment_id=payment_id
+                    ).update(**update_fields)
+                
+                # 端末向けの短期キャッシュと未確定ステータスのバックオフ状態を破棄
+                cache.delete(f"fincode:status:{payment_id}")
+                get_fincode_service().clear_poll_state(payment_id)
+                
+                if updated:
+                    logger.info("✅ Transaction updated: %s -> %s", payment_id, new_status)
                 else:
-                    logger.warning(f"⚠️ Transaction not found for payment_id: {payment_id}")
+                    # 取引記録の作成前に届いた通知は再送で反映できるよう処理済みキーを解除
+                    cache.delete(webhook_key)
+                    logger.warning("⚠️ Transaction not found for payment_id: %s", payment_id)
                     
             except Exception as e:
-                logger.error(f"❌ Database update error: {str(e)}")
+                # 再送で再処理できるよう処理済みキーを解除
+                cache.delete(webhook_key)
+                logger.error("❌ Database update error: %s", e)
         
-        return JsonResponse({"success": True, "message": "Notification processed"})
+        return OrjsonResponse({"success": True, "message": "Notification processed"})
         
-    except json.JSONDecodeError:
+    except orjson.JSONDecodeError:
         logger.error("❌ Invalid JSON in webhook")
-        return JsonResponse({"success": False, "error": "INVALID_JSON"}, status=400)
+        return OrjsonResponse({"success": False, "error": "INVALID_JSON"}, status=400)
     except Exception as e:
-        logger.error(f"❌ Webhook processing error: {str(e)}")
-        return JsonResponse({"success": False, "error": "WEBHOOK_ERROR"}, status=500)
+        logger.error("❌ Webhook processing error: %s", e)
+        return OrjsonResponse({"success": False, "error": "WEBHOOK_ERROR"}, status=500)
+
+
+def _stream_transaction_history(transactions):
+    """取引履歴JSONを行単位で出力"""
+    yield b'{"success":true,"transactions":['
+    count = 0
+    for row in transactions.iterator(chunk_size=500):
+        if count:
+            yield b','
+        # 日時はシリアライザ経由の従来形式（UTCは "Z" 表記）に合わせる
+        yield orjson.dumps(row, default=OrjsonResponse._default, option=orjson.OPT_UTC_Z)
+        count += 1
+    yield b'],"count":%d}' % count
+
+
+def _transaction_history_etag(request):
+    """取引履歴のETag（件数と最終更新時刻から算出、変化がなければ304を返す）"""
+    customer_id = request.GET.get('customer_id')
+    if not customer_id:
+        return None
+    
+    summary = PaymentTransaction.objects.filter(
+        customer__member_id=customer_id,
+        payment_method='fincode'
+    ).aggregate(latest=Max('updated_at'), count=Count('id'))
+    latest = summary['latest'].timestamp() if summary['latest'] else 0
+    return f"{customer_id}:{request.GET.get('limit', 20)}:{summary['count']}:{latest}"
 
 
 @csrf_exempt
+@condition(etag_func=_transaction_history_etag)
 def get_transaction_history(request):
     """取引履歴取得API"""
     try:
@@ -355,154 +399,31 @@ def get_transaction_history(request):
         limit = int(request.GET.get('limit', 20))
         
         if not customer_id:
-            return JsonResponse({
+            return OrjsonResponse({
                 'success': False,
                 'error': '顧客IDが必要です'
             }, status=400)
         
-        # FINCODE決済取引履歴取得
+        # FINCODE決済取引履歴取得（モデル・シリアライザを経由せず行単位でストリーミング）
         transactions = PaymentTransaction.objects.filter(
             customer__member_id=customer_id,
             payment_method='fincode'
-        ).order_by('-created_at')[:limit]
-        
-        serializer = PaymentTransactionSerializer(transactions, many=True)
+        ).order_by('-created_at').values(
+            *TRANSACTION_HISTORY_FIELDS,
+            customer_name=F('customer__username'),
+            store_name=F('store__name'),
+        )[:min(limit, TRANSACTION_HISTORY_MAX_LIMIT)]
         
-        return JsonResponse({
-            'success': True,
-            'transactions': serializer.data,
-            'count': len(serializer.data)
-        })
+        return StreamingHttpResponse(
+            _stream_transaction_history(transactions),
+            content_type='application/json'
+        )
         
     except Exception as e:
-        logger.error(f"❌ Transaction history error: {str(e)}")
-        return JsonResponse({
+        logger.error("❌ Transaction history error: %s", e)
+        return OrjsonResponse({
             'success': False,
             'error': 'サーバーエラーが発生しました',
             'detail': str(e)
         }, status=500)
 
-
-def mock_payment_page(request, order_id):
-    """
-    モック決済ページ
-    実際の決済処理をシミュレートするHTMLページを返す
-    """
-    method = request.GET.get('method', 'card')
-    amount = request.GET.get('amount', '0')
-    
-    # パラメータログ
-    logger.info(f"🎭 Mock payment page accessed: order_id={order_id}, method={method}, amount={amount}")
-    
-    # 決済ページHTMLを返す
-    html_content = f"""
-<!DOCTYPE html>
-<html lang="ja">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>FINCODE モック決済ページ - {method.upper()}</title>
-    <style>
-        body {{ 
-            font-family: Arial, sans-serif; 
-            max-width: 400px; 
-            margin: 50px auto; 
-            padding: 20px; 
-            background: #f5f5f5; 
-        }}
-        .payment-card {{ 
-            background: white; 
-            padding: 30px; 
-            border-radius: 10px; 
-            box-shadow: 0 2px 10px rgba(0,0,0,0.1); 
-            text-align: center; 
-        }}
-        .brand-logo {{ 
-            font-size: 24px; 
-            font-weight: bold; 
-            color: #2c3e50; 
-            margin-bottom: 20px; 
-        }}
-        .amount {{ 
-            font-size: 36px; 
-            color: #e74c3c; 
-            margin: 20px 0; 
-        }}
-        .btn {{
-            background: #3498db;
-            color: white;
-            border: none;
-            padding: 15px 30px;
-            font-size: 16px;
-            border-radius: 5px;
-            cursor: pointer;
-            margin: 10px;
-            min-width: 120px;
-        }}
-        .btn:hover {{ background: #2980b9; }}
-        .btn.success {{ background: #27ae60; }}
-        .btn.success:hover {{ background: #229954; }}
-        .btn.cancel {{ background: #e74c3c; }}
-        .btn.cancel:hover {{ background: #c0392b; }}
-        .order-info {{ 
-            background: #ecf0f1; 
-            padding: 15px; 
-            border-radius: 5px; 
-            margin-bottom: 20px; 
-            font-size: 14px; 
-            color: #555; 
-        }}
-        .fincode-brand {{
-            color: #3498db;
-            font-weight: bold;
-        }}
-    </style>
-</head>
-<body>
-    <div class="payment-card">
-        <div class="brand-logo"><span class="fincode-brand">FINCODE</span> モック決済</div>
-        <div class="order-info">
-            <strong>注文ID:</strong> {order_id}<br>
-            <strong>決済方法:</strong> {method.upper()}<br>
-            <strong>決済サービス:</strong> GMO FINCODE
-        </div>
-        <div class="amount">¥{amount}</div>
-        <p>これはテスト用の決済ページです。<br>実際の決済は行われません。</p>
-        <div>
-            <button class="btn success" onclick="simulateSuccess()">決済成功</button>
-            <button class="btn cancel" onclick="simulateCancel()">決済キャンセル</button>
-        </div>
-        <div style="margin-top: 20px; font-size: 12px; color: #7f8c8d;">
-            <p>🔧 開発モード: FINCODE統合テスト</p>
-        </div>
-    </div>
-    
-    <script>
-        function simulateSuccess() {{
-            alert('決済成功をシミュレートしています...');
-            // 元の画面に戻る（実際の実装ではreturn_urlにリダイレクト）
-            setTimeout(() => {{
-                window.location.href = 'http://localhost:3000/terminal-simple?payment=return&order_id={order_id}&status=success&gateway=fincode';
-            }}, 1000);
-        }}
-        
-        function simulateCancel() {{
-            alert('決済キャンセルをシミュレートしています...');
-            // 元の画面に戻る（実際の実装ではcancel_urlにリダイレクト）
-            setTimeout(() => {{
-                window.location.href = 'http://localhost:3000/terminal-simple?payment=cancel&order_id={order_id}&status=cancel&gateway=fincode';
-            }}, 1000);
-        }}
-        
-        // 自動リダイレクトオプション（15秒後）
-        setTimeout(() => {{
-            if (confirm('15秒経過しました。自動で決済成功として処理しますか？')) {{
-                simulateSuccess();
-            }}
-        }}, 15000);
-    </script>
-</body>
-</html>
-    """
-    
-    return HttpResponse(html_content, content_type='text/html')
\ No newline at end of file
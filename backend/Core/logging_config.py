@@ -0,0 +1,41 @@
+# ログ設定（ハンドラ出力をバックグラウンドスレッドへ委譲）
+
+import atexit
+import logging
+import logging.config
+import logging.handlers
+import queue
+
+
+def configure_logging(logging_settings):
+    """
+    LOGGING を適用した後、各ハンドラを QueueListener 配下へ移し、
+    ロガーには QueueHandler のみを付与する。
+    リクエストスレッドはキュー投入だけで戻り、ファイル/コンソール書き込みのロック待ちが発生しない。
+    """
+    if not logging_settings:
+        return
+
+    logging.config.dictConfig(logging_settings)
+
+    loggers = [logging.getLogger()]
+    loggers += [logging.getLogger(name) for name in logging_settings.get('loggers', {})]
+
+    queue_handlers = {}
+    for logger in loggers:
+        for index, handler in enumerate(logger.handlers):
+            if isinstance(handler, logging.handlers.QueueHandler):
+                continue
+
+            if handler not in queue_handlers:
+                log_queue = queue.SimpleQueue()
+                queue_handler = logging.handlers.QueueHandler(log_queue)
+                queue_handler.setLevel(handler.level)
+
+                listener = logging.handlers.QueueListener(log_queue, handler, respect_handler_level=True)
+                listener.start()
+                atexit.register(listener.stop)
+
+                queue_handlers[handler] = queue_handler
+
+            logger.handlers[index] = queue_handlers[handler]
@@ -35,8 +35,8 @@ class Command(BaseCommand):
                 expired_count = expired_points.count()
                 
                 self.stdout.write(f'Would expire {expired_count} point records:')
-                for point in expired_points[:10]:  # 最大10件表示
-                    self.stdout.write(f'  - {point.user.username}: {point.points}pt (expired: {point.expiry_date})')
+                for point in expired_points.values('user__username', 'points', 'expiry_date')[:10]:  # 最大10件表示
+                    self.stdout.write(f'  - {point["user__username"]}: {point["points"]}pt (expired: {point["expiry_date"]})')
                 
                 if expired_count > 10:
                     self.stdout.write(f'  ... and {expired_count - 10} more')
@@ -9,26 +9,36 @@ class Command(BaseCommand):
 
     def handle(self, *args, **options):
         with transaction.atomic():
+            existing_names = set(
+                EmailTemplate.objects.filter(
+                    name__in=[template_data['name'] for template_data in EMAIL_TEMPLATES.values()]
+                ).values_list('name', flat=True)
+            )
+            
+            new_templates = []
             for template_data in EMAIL_TEMPLATES.values():
-                template, created = EmailTemplate.objects.get_or_create(
-                    name=template_data['name'],
-                    defaults={
-                        'subject': template_data['subject'],
-                        'body_html': template_data['body_html'],
-                        'body_text': template_data['body_text'],
-                        'description': template_data['description'],
-                        'available_variables': template_data['available_variables'],
-                    }
-                )
-                
-                if created:
-                    self.stdout.write(
-                        self.style.SUCCESS(f'Created template: {template.name}')
-                    )
-                else:
+                if template_data['name'] in existing_names:
                     self.stdout.write(
-                        self.style.WARNING(f'Template already exists: {template.name}')
+                        self.style.WARNING(f'Template already exists: {template_data["name"]}')
                     )
+                    continue
+                
+                new_templates.append(EmailTemplate(
+                    name=template_data['name'],
+                    subject=template_data['subject'],
+                    body_html=template_data['body_html'],
+                    body_text=template_data['body_text'],
+                    description=template_data['description'],
+                    available_variables=template_data['available_variables'],
+                ))
+            
+            # 同時実行で先に作成された場合は既存を優先
+            EmailTemplate.objects.bulk_create(new_templates, ignore_conflicts=True)
+            
+            for template in new_templates:
+                self.stdout.write(
+                    self.style.SUCCESS(f'Created template: {template.name}')
+                )
         
         self.stdout.write(
             self.style.SUCCESS('Successfully loaded email templates')
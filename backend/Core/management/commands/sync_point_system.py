@@ -1,8 +1,11 @@
 from django.core.management.base import BaseCommand
-from django.db import transaction
+from django.db import connection, transaction
 from django.utils import timezone
+from django.db.models import Case, CharField, F, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+from collections import defaultdict
 from datetime import timedelta
-from core.models import User, UserPoint, PointTransaction
+from core.models import User, UserPoint, PointTransaction, AccountRank, Notification
 import logging
 
 logger = logging.getLogger(__name__)
@@ -10,6 +13,7 @@ logger = logging.getLogger(__name__)
 
 class Command(BaseCommand):
     help = 'Sync old point system with new unified point system'
+    batch_size = 2000  # 旧pointsフィールドの読み出し単位
 
     def add_arguments(self, parser):
         parser.add_argument(
@@ -38,75 +42,129 @@ class Command(BaseCommand):
         """古いpointsフィールドからUserPointシステムへ移行"""
         self.stdout.write('Syncing user points...')
         
-        # pointsフィールドを持つユーザーを取得（存在する場合）
-        users_with_points = []
-        try:
-            # pointsフィールドが存在するかチェック
-            from django.db import connection
-            cursor = connection.cursor()
-            cursor.execute("SELECT column_name FROM information_schema.columns WHERE table_name='core_user' AND column_name='points'")
-            if cursor.fetchone():
-                # pointsフィールドが存在する場合のクエリ
-                cursor.execute("SELECT id, username, points FROM core_user WHERE points > 0")
-                users_with_points = cursor.fetchall()
-        except Exception as e:
-            self.stdout.write(f'No old points field found or error: {e}')
+        # pointsフィールドが存在するかチェック（旧列がない環境では移行不要）
+        with connection.cursor() as cursor:
+            columns = connection.introspection.get_table_description(cursor, User._meta.db_table)
+        if not any(column.name == 'points' for column in columns):
+            self.stdout.write('No old points field found, skipping')
             return
         
         migrated_count = 0
-        for user_data in users_with_points:
-            user_id, username, points = user_data
-            
-            try:
-                user = User.objects.get(id=user_id)
-                
-                # 既存のUserPointがない場合のみ作成
-                if not user.user_points.exists():
-                    if not dry_run:
-                        # 6ヶ月後の有効期限でUserPointを作成
-                        expiry_date = timezone.now() + timedelta(days=180)
-                        UserPoint.objects.create(
-                            user=user,
-                            points=points,
-                            expiry_date=expiry_date
-                        )
-                        
-                        # 取引履歴も作成
-                        PointTransaction.objects.create(
-                            user=user,
-                            points=points,
-                            transaction_type='grant',
-                            description=f'システム移行: {points}pt',
-                            balance_before=0,
-                            balance_after=points
-                        )
-                    
-                    migrated_count += 1
-                    self.stdout.write(f'{"[DRY RUN] " if dry_run else ""}Migrated {points}pt for user {username}')
-                    
-            except User.DoesNotExist:
+        try:
+            # サーバーサイドカーソルで分割取得し、全件をメモリに載せない（単一トランザクション）
+            with transaction.atomic():
+                with connection.chunked_cursor() as cursor:
+                    cursor.execute("SELECT id, username, points FROM core_user WHERE points > 0")
+                    while True:
+                        rows = cursor.fetchmany(self.batch_size)
+                        if not rows:
+                            break
+                        migrated_count += self._migrate_point_batch(rows, dry_run)
+        except Exception as e:
+            # 移行の失敗は旧列の有無と区別して報告し、コマンドを失敗させる
+            logger.error("Point migration failed: %s", e)
+            self.stderr.write(self.style.ERROR(f'Point migration failed: {e}'))
+            raise
+        
+        self.stdout.write(f'{"[DRY RUN] " if dry_run else ""}Migrated points for {migrated_count} users')
+
+    def _migrate_point_batch(self, users_with_points, dry_run=False):
+        """取得済みの1バッチ分を移行し、移行件数を返す"""
+        user_ids = [user_id for user_id, _, _ in users_with_points]
+        existing_user_ids = set(
+            UserPoint.objects.filter(user_id__in=user_ids).values_list('user_id', flat=True)
+        )
+        found_user_ids = set(User.objects.filter(id__in=user_ids).values_list('id', flat=True))
+        
+        # 6ヶ月後の有効期限でUserPointを作成
+        expiry_date = timezone.now() + timedelta(days=180)
+        user_points = []
+        point_transactions = []
+        
+        for user_id, username, points in users_with_points:
+            if user_id not in found_user_ids:
                 self.stdout.write(f'User {username} not found, skipping')
                 continue
+            
+            # 既存のUserPointがない場合のみ作成
+            if user_id in existing_user_ids:
+                continue
+            
+            user_points.append(UserPoint(
+                user_id=user_id,
+                points=points,
+                expiry_date=expiry_date
+            ))
+            
+            # 取引履歴も作成
+            point_transactions.append(PointTransaction(
+                user_id=user_id,
+                points=points,
+                transaction_type='grant',
+                description=f'システム移行: {points}pt',
+                balance_before=0,
+                balance_after=points
+            ))
+            
+            self.stdout.write(f'{"[DRY RUN] " if dry_run else ""}Migrated {points}pt for user {username}')
         
-        self.stdout.write(f'{"[DRY RUN] " if dry_run else ""}Migrated points for {migrated_count} users')
+        if not dry_run:
+            UserPoint.objects.bulk_create(user_points, batch_size=1000)
+            PointTransaction.objects.bulk_create(point_transactions, batch_size=1000)
+        
+        return len(user_points)
 
     def sync_user_ranks(self, dry_run=False):
         """ユーザーランクの同期"""
         self.stdout.write('Syncing user ranks...')
         
-        updated_count = 0
-        for user in User.objects.filter(role='customer'):
-            old_rank = user.rank
-            
-            if not dry_run:
-                user.check_and_update_rank()
-                user.refresh_from_db()
-            
-            if user.rank != old_rank:
-                updated_count += 1
-                self.stdout.write(f'{"[DRY RUN] " if dry_run else ""}Updated rank for {user.username}: {old_rank} -> {user.rank}')
+        # check_and_update_rank() と同じ判定（付与・ボーナスの累計で適用可能な最高ランク）をSQLで一括計算
+        total_points = Subquery(
+            PointTransaction.objects.filter(
+                user=OuterRef('pk'),
+                transaction_type__in=['grant', 'bonus'],
+                points__gt=0
+            ).values('user').annotate(total=Sum('points')).values('total')
+        )
+        rank_thresholds = AccountRank.objects.order_by('-required_points').values_list('rank', 'required_points')
+        new_rank = Case(
+            *[When(total_points__gte=required_points, then=Value(rank)) for rank, required_points in rank_thresholds],
+            default=F('rank'),
+            output_field=CharField()
+        )
+        
+        changes = list(
+            User.objects.filter(role='customer')
+            .annotate(total_points=Coalesce(total_points, 0))
+            .annotate(new_rank=new_rank)
+            .exclude(new_rank=F('rank'))
+            .values_list('id', 'username', 'rank', 'new_rank')
+        )
+        
+        for _, username, old_rank, rank in changes:
+            self.stdout.write(f'{"[DRY RUN] " if dry_run else ""}Updated rank for {username}: {old_rank} -> {rank}')
+        
+        if changes and not dry_run:
+            with transaction.atomic():
+                user_ids_by_rank = defaultdict(list)
+                for user_id, _, _, rank in changes:
+                    user_ids_by_rank[rank].append(user_id)
+                for rank, user_ids in user_ids_by_rank.items():
+                    User.objects.filter(id__in=user_ids).update(rank=rank)
+                
+                # ランクアップ通知
+                Notification.objects.bulk_create([
+                    Notification(
+                        user_id=user_id,
+                        notification_type='system',
+                        title='ランクアップ！',
+                        message=f'おめでとうございます！{old_rank}から{rank}にランクアップしました！',
+                        priority='high'
+                    )
+                    for user_id, _, old_rank, rank in changes
+                ], batch_size=1000)
         
-        self.stdout.write(f'{"[DRY RUN] " if dry_run else ""}Updated ranks for {updated_count} users')
+        self.stdout.write(f'{"[DRY RUN] " if dry_run else ""}Updated ranks for {len(changes)} users')
 
     def cleanup_expired_points(self, dry_run=False):
         """期限切れポイントのクリーンアップ"""
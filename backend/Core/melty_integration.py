@@ -5,12 +5,27 @@ meltyアプリとのSSO連携機能
 会員データの同期、ランク優遇機能を提供します。
 """
 
+import atexit
+import functools
+import hashlib
+import http.cookiejar
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import logging
-from typing import Dict, Optional, Tuple
+import re
+import secrets
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, Iterable, List, Optional, Tuple
+from urllib.parse import urlencode
 from django.conf import settings
+from django.core.cache import cache
 from django.utils import timezone
 from django.core.exceptions import ValidationError
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Case, IntegerField, Q, Value, When
+from django.db.models.expressions import RawSQL
 from django.contrib.auth import get_user_model
 import jwt
 from datetime import datetime, timedelta
@@ -18,6 +33,58 @@ from datetime import datetime, timedelta
 User = get_user_model()
 logger = logging.getLogger(__name__)
 
+# MELTY API応答のキャッシュ期間（秒）
+EMAIL_EXISTS_CACHE_TIMEOUT = 600
+PROFILE_CACHE_TIMEOUT = 60
+
+# MELTY APIへの同時接続数の上限（一括同期の並列数もこれを超えない）
+MELTY_POOL_MAXSIZE = 20
+
+# プロフィール同期で更新する列
+MELTY_PROFILE_SYNC_FIELDS = ['melty_profile_data', 'melty_email']
+# 一括同期でのbulk_updateの1文あたりの行数
+MELTY_SYNC_BATCH_SIZE = 500
+
+# 新規ユーザー作成時のmember_id再生成回数の上限
+MEMBER_ID_MAX_ATTEMPTS = 5
+
+# HTMLフォールバック用の抽出パターン（全項目を1パスで走査する単一の正規表現）
+_HTML_FIELDS_RE = re.compile(
+    r'user[_\-]?id["\s]*:["\s]*(?P<user_id>[^"\s,}]+)'
+    r'|email["\s]*:["\s]*(?P<email>[^"\s,}]+)'
+    r'|name["\s]*:["\s]*(?P<name>[^"\s,}]+)'
+    # 会員種別情報（"membership" / "plan" / "subscription" / "member_type" / "is_premium" / 日本語表記）
+    r'|(?:membership|plan|subscription|member_type)["\s]*:["\s]*(?P<membership>[^"\s,}]+)'
+    r'|is_premium["\s]*:["\s]*(?P<is_premium>true|false)'
+    r'|(?P<jp_membership>有料会員|プレミアム|有料プラン)',
+    re.IGNORECASE
+)
+_HTML_PROFILE_FIELDS = ('user_id', 'email', 'name')
+_HTML_PREMIUM_VALUES = ('premium', 'paid', 'active', 'true')
+
+# MELTY APIレスポンスで会員種別を示す一般的なフィールド
+_MEMBERSHIP_FIELDS = (
+    'membership_type',      # "membership_type": "premium"
+    'plan',                 # "plan": "premium"
+    'subscription',         # "subscription": "active"
+    'member_type',          # "member_type": "paid"
+    'is_premium',           # "is_premium": true
+    'is_paid',              # "is_paid": true
+    'subscription_status',  # "subscription_status": "active"
+)
+# 有料会員を示すキーワード
+_PREMIUM_KEYWORDS_RE = re.compile(r'premium|paid|active|true|pro|plus', re.IGNORECASE)
+
+@functools.lru_cache(maxsize=4096)
+def _classify_membership(field_values: Tuple[str, ...]) -> str:
+    """会員種別フィールド値（_MEMBERSHIP_FIELDS順）から会員種別を判定"""
+    for value in field_values:
+        if value and _PREMIUM_KEYWORDS_RE.search(value):
+            return 'premium'
+    
+    # デフォルトは無料会員
+    return 'free'
+
 class MeltyIntegrationError(Exception):
     """melty連携エラー"""
     pass
@@ -25,25 +92,61 @@ class MeltyIntegrationError(Exception):
 class MeltyAPIClient:
     """melty API クライアント - SSO非対応版"""
     
-    def __init__(self):
+    def __init__(self, session: Optional[requests.Session] = None):
         # 実際のMELTY APIエンドポイント
         self.base_url = getattr(settings, 'MELTY_API_BASE_URL', 'http://app-melty.com/melty-app_system/api')
         self.api_key = getattr(settings, 'MELTY_API_KEY', '')  # API認証用
         
         if not self.api_key:
             logger.warning("melty API key not configured")
+        
+        # OAuth認可コードフロー（melty_auth_url / melty_callback / link_melty_account）用のクライアント情報
+        self.oauth_client_id = getattr(settings, 'MELTY_OAUTH_CLIENT_ID', '')
+        self.oauth_client_secret = getattr(settings, 'MELTY_OAUTH_CLIENT_SECRET', '')
+        self.oauth_redirect_uri = getattr(settings, 'MELTY_OAUTH_REDIRECT_URI', '')
+        self.oauth_authorize_url = getattr(settings, 'MELTY_OAUTH_AUTHORIZE_URL', f"{self.base_url}/oauth/authorize")
+        
+        # 接続/読み取りタイムアウト（接続確立の遅延で読み取り分の待ち時間を使い切らない）
+        self.timeout = (
+            getattr(settings, 'MELTY_CONNECT_TIMEOUT', 3.05),
+            getattr(settings, 'MELTY_READ_TIMEOUT', 10)
+        )
+        
+        # HTTPセッション（ログイン→プロフィール取得でTCP/TLS接続を再利用）
+        self.session = session or self._build_session()
+    
+    @staticmethod
+    def _build_session() -> requests.Session:
+        """接続プール付きHTTPセッションを生成"""
+        session = requests.Session()
+        session.headers.update({'User-Agent': 'BIID-PointApp/1.0'})
+        # 複数ユーザーで共有するため、レスポンスのCookieは保持しない
+        session.cookies.set_policy(http.cookiejar.DefaultCookiePolicy(allowed_domains=[]))
+        adapter = HTTPAdapter(
+            pool_connections=10,
+            pool_maxsize=MELTY_POOL_MAXSIZE,
+            max_retries=Retry(total=2, backoff_factor=0.2, status_forcelist=[502, 503, 504])
+        )
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        atexit.register(session.close)
+        return session
+    
+    def close(self):
+        """HTTPセッションを閉じる"""
+        self.session.close()
     
     def verify_user_credentials(self, email: str, password: str) -> Dict:
         """MELTY既存ログインAPIを使用して認証・会員情報取得"""
         try:
             # MELTYの既存ログインエンドポイントを使用
-            response = requests.post(f"{self.base_url}/login", {
+            response = self.session.post(f"{self.base_url}/login", {
                 'email': email,
                 'password': password
-            }, timeout=10)
+            }, timeout=self.timeout)
             
             if response.status_code == 200:
-                result = response.json()
+                result = orjson.loads(response.content)
                 user_data = result.get('user', {})
                 
                 # 会員種別情報を抽出（複数フィールドに対応）
@@ -60,112 +163,120 @@ class MeltyAPIClient:
                 }
             else:
                 return {'verified': False, 'error': 'Invalid credentials'}
-        except requests.RequestException as e:
+        except (requests.RequestException, orjson.JSONDecodeError) as e:
             logger.error(f"Failed to verify melty credentials: {str(e)}")
             return {'verified': False, 'error': str(e)}
     
+    def exchange_code_for_token(self, code: str) -> Dict:
+        """OAuth認可コードをアクセストークンに交換"""
+        try:
+            response = self.session.post(f"{self.base_url}/oauth/token", {
+                'grant_type': 'authorization_code',
+                'code': code,
+                'client_id': self.oauth_client_id,
+                'client_secret': self.oauth_client_secret,
+                'redirect_uri': self.oauth_redirect_uri
+            }, timeout=self.timeout)
+            
+            if response.status_code != 200:
+                raise MeltyIntegrationError(f"Token exchange failed: {response.status_code}")
+            return orjson.loads(response.content)
+        except (requests.RequestException, orjson.JSONDecodeError) as e:
+            logger.error(f"Failed to exchange melty authorization code: {str(e)}")
+            raise MeltyIntegrationError(f"Token exchange failed: {str(e)}")
+    
     def _extract_membership_type(self, user_data: Dict) -> str:
         """ユーザーデータから会員種別を抽出"""
-        # MELTY APIレスポンスの一般的なフィールドをチェック
-        membership_fields = [
-            'membership_type',    # "membership_type": "premium"
-            'plan',              # "plan": "premium"
-            'subscription',      # "subscription": "active"
-            'member_type',       # "member_type": "paid"
-            'is_premium',        # "is_premium": true
-            'is_paid',           # "is_paid": true
-            'subscription_status', # "subscription_status": "active"
-        ]
-        
-        for field in membership_fields:
-            value = user_data.get(field)
-            if value:
-                # 文字列の場合は小文字に変換
-                str_value = str(value).lower() if value else ''
-                
-                # 有料会員を示すキーワード
-                premium_keywords = ['premium', 'paid', 'active', 'true', 'pro', 'plus']
-                if any(keyword in str_value for keyword in premium_keywords):
-                    return 'premium'
-        
-        # デフォルトは無料会員
-        return 'free'
+        field_values = tuple(str(value) if value else '' for value in map(user_data.get, _MEMBERSHIP_FIELDS))
+        return _classify_membership(field_values)
     
     def get_user_profile_with_session(self, session_token: str) -> Dict:
-        """MELTYセッショントークンでユーザープロフィール取得"""
+        """MELTYセッショントークンでユーザープロフィール取得（短時間キャッシュ）"""
+        cache_key = f"melty:profile:{hashlib.sha256(session_token.encode()).hexdigest()}"
+        profile = cache.get(cache_key)
+        if profile is not None:
+            return profile
+        
         try:
             # MELTYの既存プロフィールAPIを使用
             headers = {
                 'Authorization': f'Bearer {session_token}',
                 'Cookie': f'session_token={session_token}'  # セッションクッキーも設定
             }
-            response = requests.get(f"{self.base_url}/profile", headers=headers, timeout=10)
+            response = self.session.get(f"{self.base_url}/profile", headers=headers, timeout=self.timeout)
             
             if response.status_code == 200:
-                return response.json()
+                profile = orjson.loads(response.content)
             else:
+                if not getattr(settings, 'MELTY_ENABLE_HTML_FALLBACK', False):
+                    raise MeltyIntegrationError(f"Profile fetch failed: {response.status_code}")
+                
                 # フォールバック: ユーザーダッシュボードの既存エンドポイントを試す
-                response = requests.get(f"{self.base_url}/dashboard", headers=headers, timeout=10)
-                if response.status_code == 200:
-                    # HTMLレスポンスからユーザー情報を抽出（簡単なスクレイピング）
-                    return self._extract_user_info_from_html(response.text)
-                raise MeltyIntegrationError(f"Profile fetch failed: {response.status_code}")
-        except requests.RequestException as e:
+                logger.warning(f"melty profile API returned {response.status_code}, falling back to dashboard HTML")
+                response = self.session.get(f"{self.base_url}/dashboard", headers=headers, timeout=self.timeout)
+                if response.status_code != 200:
+                    raise MeltyIntegrationError(f"Profile fetch failed: {response.status_code}")
+                # HTMLレスポンスからユーザー情報を抽出（簡単なスクレイピング）
+                profile = self._extract_user_info_from_html(response.text)
+        except (requests.RequestException, orjson.JSONDecodeError) as e:
             logger.error(f"Failed to get melty user profile: {str(e)}")
             raise MeltyIntegrationError(f"Profile fetch failed: {str(e)}")
+        
+        cache.set(cache_key, profile, PROFILE_CACHE_TIMEOUT)
+        return profile
     
     def check_user_exists_via_password_reset(self, email: str) -> bool:
-        """MELTYパスワードリセットAPIでユーザー存在確認"""
+        """MELTYパスワードリセットAPIでユーザー存在確認（判定結果はキャッシュ）"""
+        cache_key = f"melty:exists:{hashlib.sha256(email.lower().encode()).hexdigest()}"
+        exists = cache.get(cache_key)
+        if exists is not None:
+            return exists
+        
         try:
             # パスワードリセットリクエストでユーザー存在を確認
-            response = requests.post(f"{self.base_url}/password-reset", {
+            response = self.session.post(f"{self.base_url}/password-reset", {
                 'email': email
-            }, timeout=10)
-            
-            # ユーザーが存在する場合は200、存在しない場合は404またはエラーメッセージ
-            if response.status_code == 200:
-                return True
-            elif response.status_code == 404:
-                return False
-            else:
-                # レスポンス内容をチェック
-                content = response.text.lower()
-                return 'user not found' not in content and 'email not found' not in content
+            }, timeout=self.timeout)
         except requests.RequestException:
             return False
+        
+        # ユーザーが存在する場合は200、存在しない場合は404またはエラーメッセージ
+        if response.status_code == 200:
+            exists = True
+        elif response.status_code == 404:
+            exists = False
+        else:
+            # レスポンス内容をチェック
+            content = response.text.lower()
+            exists = 'user not found' not in content and 'email not found' not in content
+        
+        cache.set(cache_key, exists, EMAIL_EXISTS_CACHE_TIMEOUT)
+        return exists
     
     def _extract_user_info_from_html(self, html: str) -> Dict:
         """HTMLレスポンスからユーザー情報を抽出"""
         try:
-            import re
-            # 簡単な正規表現でユーザー情報を抽出
-            user_id_match = re.search(r'user[_\-]?id["\s]*:["\s]*([^"\s,}]+)', html, re.IGNORECASE)
-            email_match = re.search(r'email["\s]*:["\s]*([^"\s,}]+)', html, re.IGNORECASE)
-            name_match = re.search(r'name["\s]*:["\s]*([^"\s,}]+)', html, re.IGNORECASE)
-            
-            # 会員種別情報を抽出（複数パターンに対応）
-            membership_patterns = [
-                r'membership["\s]*:["\s]*([^"\s,}]+)',  # "membership": "premium"
-                r'plan["\s]*:["\s]*([^"\s,}]+)',        # "plan": "premium"
-                r'subscription["\s]*:["\s]*([^"\s,}]+)', # "subscription": "active"
-                r'member_type["\s]*:["\s]*([^"\s,}]+)',  # "member_type": "paid"
-                r'is_premium["\s]*:["\s]*(true|false)',  # "is_premium": true
-                r'有料会員|プレミアム|有料プラン',          # 日本語パターン
-            ]
-            
+            # 単一の正規表現でユーザー情報・会員種別を抽出（全項目が揃えば打ち切り）
+            profile = {}
             membership_info = 'free'  # デフォルトは無料会員
-            for pattern in membership_patterns:
-                match = re.search(pattern, html, re.IGNORECASE)
-                if match:
-                    value = match.group(1).lower()
-                    if value in ['premium', 'paid', 'active', 'true'] or '有料' in value or 'プレミアム' in value:
+            for match in _HTML_FIELDS_RE.finditer(html):
+                field = match.lastgroup
+                value = match.group(field)
+                
+                if field in _HTML_PROFILE_FIELDS:
+                    profile.setdefault(field, value)
+                elif membership_info == 'free':
+                    value = value.lower()
+                    if value in _HTML_PREMIUM_VALUES or '有料' in value or 'プレミアム' in value:
                         membership_info = 'premium'
-                        break
+                
+                if membership_info == 'premium' and len(profile) == len(_HTML_PROFILE_FIELDS):
+                    break
             
             return {
-                'user_id': user_id_match.group(1) if user_id_match else '',
-                'email': email_match.group(1) if email_match else '',
-                'name': name_match.group(1) if name_match else '',
+                'user_id': profile.get('user_id', ''),
+                'email': profile.get('email', ''),
+                'name': profile.get('name', ''),
                 'membership_type': membership_info,
                 'extracted_from_html': True
             }
@@ -176,8 +287,8 @@ class MeltyAPIClient:
 class MeltyUserService:
     """meltyユーザー管理サービス"""
     
-    def __init__(self):
-        self.api_client = MeltyAPIClient()
+    def __init__(self, api_client: Optional[MeltyAPIClient] = None):
+        self.api_client = api_client or MeltyAPIClient()
     
     def create_biid_account_from_melty(self, email: str, first_name: str, 
                                      last_name: str, melty_password: str) -> Tuple[User, bool]:
@@ -200,44 +311,52 @@ class MeltyUserService:
             melty_email = auth_result.get('email', email)
             session_token = auth_result.get('token', '')
             
-            # 3. セッショントークンがある場合は詳細プロフィールを取得
-            if session_token:
-                try:
-                    detailed_profile = self.api_client.get_user_profile_with_session(session_token)
-                    melty_user_data.update(detailed_profile)
-                except Exception as e:
-                    logger.warning(f"Failed to get detailed profile: {str(e)}")
-            
             if not melty_user_id:
                 raise MeltyIntegrationError("melty user ID not found in authentication response")
             
-            # 4. 既存のmelty連携アカウントチェック
-            existing_user = None
-            try:
-                existing_user = User.objects.get(melty_user_id=melty_user_id)
+            # 3-4. 既存のmelty連携アカウント・同じメールアドレスの既存ユーザーを1クエリでチェック
+            existing_user = self._find_existing_user(melty_user_id, melty_email)
+            
+            if existing_user is not None and existing_user.melty_user_id == melty_user_id:
+                # 連携済みユーザーは詳細プロフィール不要（MELTYへの追加呼び出しを行わない）
                 logger.info(f"Found existing melty-linked user: {existing_user.username}")
                 return existing_user, False
-            except User.DoesNotExist:
-                pass
             
-            # 5. 同じメールアドレスの既存ユーザーチェック
-            try:
-                existing_user = User.objects.get(email=melty_email)
-                # 既存ユーザーにmelty連携を追加
-                return self.link_melty_to_existing_user(existing_user, melty_user_id, melty_user_data), False
-            except User.DoesNotExist:
-                pass
+            # 5. 連携追加・新規作成時のみ、セッショントークンで詳細プロフィールを取得
+            if session_token:
+                try:
+                    melty_user_data.update(self.api_client.get_user_profile_with_session(session_token))
+                except Exception as e:
+                    logger.warning(f"Failed to get detailed profile: {str(e)}")
             
-            # 6. 新規biidアカウント作成（MELTY会員種別に応じたランク）
-            melty_membership = auth_result.get('membership_type', 'free')
-            new_user = self.create_new_biid_user_with_melty(
-                email=melty_email,
-                first_name=first_name,
-                last_name=last_name,
-                melty_user_id=melty_user_id,
-                melty_profile=melty_user_data,
-                melty_membership_type=melty_membership
-            )
+            # 連携追加・新規作成は行ロック下で再確認してから行う（同時ログインによる重複連携・重複作成を防止）
+            try:
+                with transaction.atomic():
+                    existing_user = self._find_existing_user(melty_user_id, melty_email, for_update=True)
+                    
+                    if existing_user is not None:
+                        if existing_user.melty_user_id == melty_user_id:
+                            return existing_user, False
+                        # 既存ユーザーにmelty連携を追加
+                        return self.link_melty_to_existing_user(existing_user, melty_user_id, melty_user_data), False
+                    
+                    # 6. 新規biidアカウント作成（MELTY会員種別に応じたランク）
+                    melty_membership = auth_result.get('membership_type', 'free')
+                    new_user = self.create_new_biid_user_with_melty(
+                        email=melty_email,
+                        first_name=first_name,
+                        last_name=last_name,
+                        melty_user_id=melty_user_id,
+                        melty_profile=melty_user_data,
+                        melty_membership_type=melty_membership
+                    )
+            except IntegrityError:
+                # 同時ログインで他のワーカーが先に作成済みの場合はそのユーザーを返す
+                existing_user = User.objects.filter(melty_user_id=melty_user_id).first()
+                if existing_user is None:
+                    raise
+                logger.info(f"melty user created concurrently: {existing_user.username}")
+                return existing_user, False
             
             logger.info(f"Created new biid user from melty: {new_user.username} (Silver rank)")
             return new_user, True
@@ -246,22 +365,37 @@ class MeltyUserService:
             logger.error(f"Failed to create biid account from melty: {str(e)}")
             raise MeltyIntegrationError(f"Account creation failed: {str(e)}")
     
+    def _find_existing_user(self, melty_user_id: str, melty_email: str, for_update: bool = False) -> Optional[User]:
+        """melty_user_id一致またはメールアドレス一致の既存ユーザーを取得（melty_user_id一致を優先）"""
+        queryset = User.objects.filter(Q(melty_user_id=melty_user_id) | Q(email=melty_email))
+        if for_update:
+            queryset = queryset.select_for_update()
+        return queryset.annotate(
+            melty_match=Case(
+                When(melty_user_id=melty_user_id, then=Value(0)),
+                default=Value(1),
+                output_field=IntegerField()
+            )
+        ).order_by('melty_match', 'pk').first()
+    
     def create_new_biid_user_with_melty(self, email: str, first_name: str, 
                                        last_name: str, melty_user_id: str, 
                                        melty_profile: Dict, 
                                        melty_membership_type: str = 'free') -> User:
         """melty連携付きの新規biidユーザー作成（会員種別連動）"""
         
-        # ユニークなusernameを生成
+        # ユニークなusernameを生成（衝突候補は1クエリでまとめて取得）
         base_username = f"{first_name}_{last_name}".lower()
+        existing_usernames = set(
+            User.objects.filter(username__startswith=base_username).values_list('username', flat=True)
+        )
         username = base_username
         counter = 1
-        while User.objects.filter(username=username).exists():
+        while username in existing_usernames:
             username = f"{base_username}_{counter}"
             counter += 1
         
         # MELTY会員種別に応じたmember_idプレフィックスと初期ランク
-        import uuid
         if melty_membership_type == 'premium':
             # MELTY有料会員はゴールドランクでスタート
             member_id_prefix = "G"  # Gold
@@ -271,26 +405,34 @@ class MeltyUserService:
             member_id_prefix = "S"  # Silver 
             initial_rank = 'silver'
         
-        member_id = f"{member_id_prefix}{str(uuid.uuid4().hex[:8]).upper()}"
-        while User.objects.filter(member_id=member_id).exists():
-            member_id = f"{member_id_prefix}{str(uuid.uuid4().hex[:8]).upper()}"
-        
-        # melty経由ユーザー作成
-        user = User.objects.create_user(
-            username=username,
-            email=email,
-            first_name=first_name,
-            last_name=last_name,
-            member_id=member_id,
-            rank=initial_rank,  # MELTY会員種別に応じたランク
-            registration_source='melty',
-            melty_user_id=melty_user_id,
-            melty_email=email,
-            melty_connected_at=timezone.now(),
-            is_melty_linked=True,
-            melty_profile_data=melty_profile,
-            is_active=True
-        )
+        # melty経由ユーザー作成（member_idは事前確認せず、一意制約違反時のみusername/member_idを再生成）
+        for attempt in range(MEMBER_ID_MAX_ATTEMPTS):
+            member_id = f"{member_id_prefix}{secrets.token_hex(4).upper()}"
+            try:
+                with transaction.atomic():
+                    user = User.objects.create_user(
+                        username=username,
+                        email=email,
+                        first_name=first_name,
+                        last_name=last_name,
+                        member_id=member_id,
+                        rank=initial_rank,  # MELTY会員種別に応じたランク
+                        registration_source='melty',
+                        melty_user_id=melty_user_id,
+                        melty_email=email,
+                        melty_connected_at=timezone.now(),
+                        is_melty_linked=True,
+                        melty_profile_data=melty_profile,
+                        is_active=True
+                    )
+                break
+            except IntegrityError:
+                # melty_user_idの競合（同時作成）はmember_idを変えても解消しない
+                if attempt == MEMBER_ID_MAX_ATTEMPTS - 1 or User.objects.filter(melty_user_id=melty_user_id).exists():
+                    raise
+                logger.warning(f"Retrying melty user creation after conflict: {username} ({member_id})")
+                # 同時登録でusernameが先取りされた場合も再試行で解消できるよう再生成
+                username = f"{base_username}_{secrets.token_hex(3)}"
         
         # MELTY会員種別に応じたウェルカムボーナスを付与
         self.grant_melty_welcome_bonus(user, melty_membership_type)
@@ -327,7 +469,10 @@ class MeltyUserService:
         if not rank_upgraded:
             logger.info(f"User {user.username} melty link completed - no rank upgrade needed (current: {user.rank})")
         
-        user.save()
+        user.save(update_fields=[
+            'melty_user_id', 'melty_email', 'melty_connected_at',
+            'is_melty_linked', 'melty_profile_data', 'rank'
+        ])
         return user
     
     def grant_melty_welcome_bonus(self, user: User, melty_membership_type: str = 'free'):
@@ -346,32 +491,74 @@ class MeltyUserService:
                 source_description = "MELTYアプリ連携ウェルカムボーナス【シルバー特典】"
                 logger.info(f"Granted MELTY Free welcome bonus {bonus_points}pt to user {user.username} (Silver rank)")
             
-            user.add_points(
-                points=bonus_points,
-                expiry_months=expiry_months,
-                source_description=source_description
-            )
+            # 付与失敗時に呼び出し元のトランザクションを巻き込まないようセーブポイント内で実行
+            with transaction.atomic():
+                user.add_points(
+                    points=bonus_points,
+                    expiry_months=expiry_months,
+                    source_description=source_description
+                )
             
         except Exception as e:
             logger.error(f"Failed to grant melty welcome bonus: {str(e)}")
     
-    def sync_melty_profile(self, user: User) -> bool:
-        """meltyプロフィール情報を同期"""
+    def _apply_profile_changes(self, user: User, melty_profile: Dict) -> User:
+        """取得したmeltyプロフィールをユーザーに反映（保存は呼び出し元で行う）"""
+        # プロフィール情報を更新
+        user.melty_profile_data = melty_profile
+        
+        # メールアドレスが変更されている場合は更新
+        melty_email = melty_profile.get('email')
+        if melty_email and melty_email != user.melty_email:
+            user.melty_email = melty_email
+        
+        return user
+    
+    def _profile_patch_expression(self, melty_profile: Dict, changed: Dict, removed: List[str]):
+        """melty_profile_dataの更新値（PostgreSQLでは差分キーのみをjsonbでマージ）"""
+        if connection.vendor != 'postgresql':
+            return melty_profile
+        
+        sql = "COALESCE(melty_profile_data, '{}'::jsonb) || %s::jsonb"
+        params = [orjson.dumps(changed).decode()]
+        if removed:
+            sql = f"({sql}) - %s::text[]"
+            params.append(removed)
+        return RawSQL(sql, params)
+    
+    def _fetch_profile_for(self, user: User, session_token: str) -> Dict:
+        """ユーザーのMELTYセッショントークンでプロフィールを取得（別アカウントのプロフィールは反映しない）"""
+        melty_profile = self.api_client.get_user_profile_with_session(session_token)
+        profile_user_id = melty_profile.get('user_id') or melty_profile.get('id')
+        if profile_user_id and str(profile_user_id) != str(user.melty_user_id):
+            raise MeltyIntegrationError(f"melty profile belongs to another account: {profile_user_id}")
+        return melty_profile
+    
+    def sync_melty_profile(self, user: User, session_token: str) -> bool:
+        """meltyプロフィール情報を同期（プロフィールはユーザーのMELTYセッショントークンで取得）"""
         try:
-            if not user.is_melty_linked or not user.melty_user_id:
+            if not user.is_melty_linked or not user.melty_user_id or not session_token:
                 return False
             
-            melty_profile = self.api_client.get_user_profile(user.melty_user_id)
+            melty_profile = self._fetch_profile_for(user, session_token)
             
-            # プロフィール情報を更新
-            user.melty_profile_data = melty_profile
+            # 変更のあったキーのみを抽出（変更がなければ書き込みを行わない）
+            current_profile = user.melty_profile_data or {}
+            changed = {key: value for key, value in melty_profile.items()
+                       if key not in current_profile or current_profile[key] != value}
+            removed = [key for key in current_profile if key not in melty_profile]
+            current_email = user.melty_email
             
-            # メールアドレスが変更されている場合は更新
-            melty_email = melty_profile.get('email')
-            if melty_email and melty_email != user.melty_email:
-                user.melty_email = melty_email
+            self._apply_profile_changes(user, melty_profile)
             
-            user.save()
+            if not changed and not removed and user.melty_email == current_email:
+                logger.info(f"melty profile unchanged for user {user.username}")
+                return True
+            
+            update_fields = {'melty_email': user.melty_email}
+            if changed or removed:
+                update_fields['melty_profile_data'] = self._profile_patch_expression(melty_profile, changed, removed)
+            User.objects.filter(pk=user.pk).update(**update_fields)
             logger.info(f"Synced melty profile for user {user.username}")
             return True
             
@@ -379,6 +566,45 @@ class MeltyUserService:
             logger.error(f"Failed to sync melty profile: {str(e)}")
             return False
     
+    def bulk_sync_melty_profiles(self, user_sessions: Iterable[Tuple[User, str]], max_workers: int = 16) -> int:
+        """
+        複数ユーザーのmeltyプロフィールを並列取得して同期
+        
+        Args:
+            user_sessions: (ユーザー, MELTYセッショントークン) の組
+        
+        Returns:
+            int: 同期できたユーザー数
+        """
+        linked_sessions = [
+            (user, session_token) for user, session_token in user_sessions
+            if user.is_melty_linked and user.melty_user_id and session_token
+        ]
+        if not linked_sessions:
+            return 0
+        
+        # HTTP取得のみスレッドで並列化（接続プールの上限を超えない並列数）、DB更新は呼び出し元スレッドでまとめて行う
+        changed_users = []
+        with ThreadPoolExecutor(max_workers=min(max_workers, MELTY_POOL_MAXSIZE)) as executor:
+            futures = {
+                executor.submit(self._fetch_profile_for, user, session_token): user
+                for user, session_token in linked_sessions
+            }
+            for future in as_completed(futures):
+                user = futures[future]
+                try:
+                    changed_users.append(self._apply_profile_changes(user, future.result()))
+                except Exception as e:
+                    logger.error(f"Failed to sync melty profile for user {user.username}: {str(e)}")
+        
+        if changed_users:
+            with transaction.atomic():
+                User.objects.bulk_update(changed_users, MELTY_PROFILE_SYNC_FIELDS, batch_size=MELTY_SYNC_BATCH_SIZE)
+        
+        synced = len(changed_users)
+        logger.info(f"Bulk synced melty profiles: {synced}/{len(linked_sessions)} users")
+        return synced
+    
     def unlink_melty_account(self, user: User) -> bool:
         """meltyアカウント連携を解除"""
         try:
@@ -387,7 +613,10 @@ class MeltyUserService:
             user.melty_connected_at = None
             user.is_melty_linked = False
             user.melty_profile_data = {}
-            user.save()
+            user.save(update_fields=[
+                'melty_user_id', 'melty_email', 'melty_connected_at',
+                'is_melty_linked', 'melty_profile_data'
+            ])
             
             logger.info(f"Unlinked melty account for user {user.username}")
             return True
@@ -399,9 +628,10 @@ class MeltyUserService:
 class MeltyDirectAuth:
     """melty 直接認証方式（SSO非対応版）"""
     
-    def __init__(self):
-        self.api_client = MeltyAPIClient()
-        self.user_service = MeltyUserService()
+    def __init__(self, api_client: Optional[MeltyAPIClient] = None,
+                 user_service: Optional[MeltyUserService] = None):
+        self.api_client = api_client or MeltyAPIClient()
+        self.user_service = user_service or MeltyUserService(api_client=self.api_client)
     
     def authenticate_user(self, email: str, password: str) -> Tuple[User, bool]:
         """
@@ -438,11 +668,57 @@ class MeltyDirectAuth:
             logger.error(f"melty direct auth failed: {str(e)}")
             raise MeltyIntegrationError(f"Direct auth failed: {str(e)}")
     
+    def generate_auth_url(self, state: str) -> str:
+        """melty OAuth認可画面のURLを生成"""
+        query = urlencode({
+            'response_type': 'code',
+            'client_id': self.api_client.oauth_client_id,
+            'redirect_uri': self.api_client.oauth_redirect_uri,
+            'state': state
+        })
+        return f"{self.api_client.oauth_authorize_url}?{query}"
+    
+    def handle_callback(self, code: str, state: str) -> Tuple[User, str]:
+        """
+        OAuthコールバックの認可コードから連携済みユーザーを特定（stateは呼び出し元で検証済み）
+        
+        Returns:
+            Tuple[User, str]: (ユーザーオブジェクト, meltyアクセストークン)
+        """
+        token_data = self.api_client.exchange_code_for_token(code)
+        access_token = token_data.get('access_token')
+        if not access_token:
+            raise MeltyIntegrationError("melty access token not found in token response")
+        
+        melty_profile = self.api_client.get_user_profile_with_session(access_token)
+        melty_user_id = melty_profile.get('user_id') or melty_profile.get('id')
+        if not melty_user_id:
+            raise MeltyIntegrationError("melty user ID not found in profile")
+        
+        user = User.objects.filter(melty_user_id=str(melty_user_id)).first()
+        if user is None:
+            # 未連携のmeltyユーザーは登録画面へ誘導（呼び出し元でメッセージを判定）
+            raise MeltyIntegrationError("User not found - registration required")
+        
+        logger.info(f"melty OAuth login: {user.username}")
+        return user, access_token
+    
     def verify_email_exists(self, email: str) -> bool:
         """meltyアカウントのメール存在確認"""
         return self.api_client.check_user_exists_via_password_reset(email)
 
-# サービスインスタンス
-melty_direct_auth = MeltyDirectAuth()
-melty_user_service = MeltyUserService()
-melty_api_client = MeltyAPIClient()
\ No newline at end of file
+# サービスインスタンス（初回利用時に生成し、APIクライアントの接続プールを共有）
+@functools.lru_cache(maxsize=1)
+def get_melty_direct_auth() -> MeltyDirectAuth:
+    """MeltyDirectAuthシングルトン取得"""
+    return MeltyDirectAuth(api_client=get_melty_api_client(), user_service=get_melty_user_service())
+
+@functools.lru_cache(maxsize=1)
+def get_melty_user_service() -> MeltyUserService:
+    """MeltyUserServiceシングルトン取得"""
+    return MeltyUserService(api_client=get_melty_api_client())
+
+@functools.lru_cache(maxsize=1)
+def get_melty_api_client() -> MeltyAPIClient:
+    """MeltyAPIClientシングルトン取得"""
+    return MeltyAPIClient()
@@ -3,31 +3,81 @@ meltyアプリ連携用のAPIビュー
 """
 
 from rest_framework import status, permissions
-from rest_framework.decorators import api_view, permission_classes
+from rest_framework.decorators import api_view, permission_classes, throttle_classes
+from rest_framework.throttling import BaseThrottle
 from rest_framework.response import Response
 from django.contrib.auth import get_user_model, login
 from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
 from django.urls import reverse
 from django.http import HttpResponseRedirect
 import logging
+import secrets
+import time
+import uuid
+from datetime import timedelta
 
-from .melty_integration import melty_direct_auth, melty_user_service, MeltyIntegrationError
+from .melty_integration import get_melty_direct_auth, get_melty_user_service, MeltyIntegrationError
+from .models import UserPoint, PointTransaction
 from .serializers import UserSerializer
 
 User = get_user_model()
 logger = logging.getLogger(__name__)
 
+# 直接登録時のウェルカムボーナス（ポイント、6ヶ月有効）
+DIRECT_WELCOME_BONUS_POINTS = 500
+
+# 直接登録時のusername/member_id再生成回数の上限
+REGISTRATION_MAX_ATTEMPTS = 5
+
+# OAuth stateの有効期間（秒）
+MELTY_OAUTH_STATE_MAX_AGE = 600
+_oauth_state_signer = signing.TimestampSigner(salt='core.melty_views.oauth_state')
+
+# 登録・連携レスポンスで返すユーザー項目（書き込み系ではシリアライザを介さない）
+USER_RESPONSE_FIELDS = ('id', 'username', 'email', 'rank', 'member_id', 'is_melty_linked')
+
+def _user_response_data(user):
+    """登録・連携レスポンス用のユーザー情報"""
+    return {field: getattr(user, field) for field in USER_RESPONSE_FIELDS}
+
+class MeltyAuthRateThrottle(BaseThrottle):
+    """
+    認証・登録系エンドポイントのIP単位レート制限
+    固定窓ごとのキャッシュカウンタ（Redisでは INCR）で計数するため、並行リクエストでも取りこぼさない
+    """
+    rate = 20     # 窓あたりの上限リクエスト数
+    window = 60   # 窓の長さ（秒）
+    
+    def allow_request(self, request, view):
+        key = f"rl:melty_auth:{self.get_ident(request)}:{int(time.time()) // self.window}"
+        cache.add(key, 0, self.window)
+        try:
+            count = cache.incr(key)
+        except ValueError:
+            # add直後に失効した場合
+            cache.set(key, 1, self.window)
+            count = 1
+        # キャッシュ障害時（IGNORE_EXCEPTIONS）は制限しない
+        return count is None or count <= self.rate
+    
+    def wait(self):
+        return self.window - time.time() % self.window
+
 @api_view(['GET'])
 @permission_classes([permissions.AllowAny])
+@throttle_classes([MeltyAuthRateThrottle])
 def melty_auth_url(request):
     """melty OAuth認証URL取得"""
     try:
-        # CSRF対策のためのstate生成
-        import secrets
-        state = secrets.token_urlsafe(32)
-        request.session['melty_oauth_state'] = state
+        # CSRF対策のためのstate生成（署名付き・期限付きのためセッションへは保存しない）
+        state = _oauth_state_signer.sign(secrets.token_urlsafe(16))
         
-        auth_url = melty_direct_auth.generate_auth_url(state=state)
+        auth_url = get_melty_direct_auth().generate_auth_url(state=state)
         
         return Response({
             'success': True,
@@ -35,7 +85,7 @@ def melty_auth_url(request):
             'state': state
         })
     except Exception as e:
-        logger.error(f"Failed to generate melty auth URL: {str(e)}")
+        logger.error("Failed to generate melty auth URL: %s", e)
         return Response({
             'success': False,
             'error': 'Auth URL generation failed'
@@ -43,6 +93,7 @@ def melty_auth_url(request):
 
 @api_view(['GET'])
 @permission_classes([permissions.AllowAny])
+@throttle_classes([MeltyAuthRateThrottle])
 def melty_callback(request):
     """melty OAuth コールバック処理"""
     try:
@@ -52,29 +103,27 @@ def melty_callback(request):
         error = request.GET.get('error')
         
         if error:
-            logger.warning(f"melty OAuth error: {error}")
+            logger.warning("melty OAuth error: %s", error)
             return HttpResponseRedirect(f"/user/login?error=melty_auth_failed")
         
         if not code:
             return HttpResponseRedirect(f"/user/login?error=missing_code")
         
-        # state検証
-        session_state = request.session.get('melty_oauth_state')
-        if not session_state or session_state != state:
+        # state検証（署名と発行からの経過時間を確認）
+        try:
+            _oauth_state_signer.unsign(state or '', max_age=MELTY_OAUTH_STATE_MAX_AGE)
+        except signing.BadSignature:
             logger.warning("melty OAuth state mismatch")
             return HttpResponseRedirect(f"/user/login?error=state_mismatch")
         
         # melty SSO処理
         try:
-            user, access_token = melty_direct_auth.handle_callback(code, state)
+            user, access_token = get_melty_direct_auth().handle_callback(code, state)
             
             # Django認証
             login(request, user)
             
-            # セッション情報をクリア
-            request.session.pop('melty_oauth_state', None)
-            
-            logger.info(f"melty SSO successful for user: {user.username}")
+            logger.info("melty SSO successful for user: %s", user.username)
             return HttpResponseRedirect("/user?melty_login=success")
             
         except MeltyIntegrationError as e:
@@ -82,11 +131,11 @@ def melty_callback(request):
                 # 新規ユーザーの場合は登録画面へ
                 return HttpResponseRedirect(f"/user/register?source=melty&code={code}")
             else:
-                logger.error(f"melty SSO failed: {str(e)}")
+                logger.error("melty SSO failed: %s", e)
                 return HttpResponseRedirect(f"/user/login?error=melty_sso_failed")
         
     except Exception as e:
-        logger.error(f"melty callback error: {str(e)}")
+        logger.error("melty callback error: %s", e)
         return HttpResponseRedirect(f"/user/login?error=callback_error")
 
 @api_view(['POST'])
@@ -107,9 +156,9 @@ def register_with_melty(request):
                 'error': '必須項目が不足しています'
             }, status=status.HTTP_400_BAD_REQUEST)
         
-        # melty経由でbiidアカウント作成
-        user, is_new = melty_user_service.create_biid_account_from_melty(
-            melty_user_id=melty_user_id,
+        # melty経由でbiidアカウント作成（melty_user_idはmeltyログイン応答から取得）
+        # 二重送信・再試行はmelty認証後に既存ユーザーとして返る（melty_user_idの一意制約とIntegrityError時の再取得で重複作成を防止）
+        user, is_new = get_melty_user_service().create_biid_account_from_melty(
             email=email,
             first_name=first_name,
             last_name=last_name,
@@ -119,12 +168,12 @@ def register_with_melty(request):
         # Django認証
         login(request, user)
         
-        # ユーザー情報をシリアライズ
-        serializer = UserSerializer(user)
+        # レスポンス用のユーザー情報
+        user_data = _user_response_data(user)
         
         return Response({
             'success': True,
-            'user': serializer.data,
+            'user': user_data,
             'is_new_user': is_new,
             'rank': user.rank,
             'welcome_bonus': 1000 if is_new else 0,
@@ -132,13 +181,13 @@ def register_with_melty(request):
         }, status=status.HTTP_201_CREATED if is_new else status.HTTP_200_OK)
         
     except MeltyIntegrationError as e:
-        logger.error(f"melty registration failed: {str(e)}")
+        logger.error("melty registration failed: %s", e)
         return Response({
             'success': False,
             'error': str(e)
         }, status=status.HTTP_400_BAD_REQUEST)
     except Exception as e:
-        logger.error(f"Unexpected melty registration error: {str(e)}")
+        logger.error("Unexpected melty registration error: %s", e)
         return Response({
             'success': False,
             'error': '登録処理中にエラーが発生しました'
@@ -146,6 +195,7 @@ def register_with_melty(request):
 
 @api_view(['POST'])
 @permission_classes([permissions.AllowAny])
+@throttle_classes([MeltyAuthRateThrottle])
 def register_direct(request):
     """biid直接登録（ブロンズランク）"""
     try:
@@ -161,66 +211,84 @@ def register_direct(request):
                 'error': '必須項目が不足しています'
             }, status=status.HTTP_400_BAD_REQUEST)
         
-        # 既存ユーザーチェック
-        if User.objects.filter(email=email).exists():
-            return Response({
-                'success': False,
-                'error': 'このメールアドレスは既に登録されています'
-            }, status=status.HTTP_400_BAD_REQUEST)
+        # メールアドレスは正規化して保存・照合（大文字小文字違いの重複登録を防止）
+        email = email.strip().lower()
         
-        # ユニークなusernameを生成
+        # 既存ユーザーチェック（メールアドレスとusername候補の衝突を1クエリで確認）
         base_username = f"{first_name}_{last_name}".lower()
-        username = base_username
-        counter = 1
-        while User.objects.filter(username=username).exists():
-            username = f"{base_username}_{counter}"
-            counter += 1
-        
-        # ユニークなmember_idを生成
-        import uuid
-        member_id = f"B{str(uuid.uuid4().hex[:8]).upper()}"
-        while User.objects.filter(member_id=member_id).exists():
-            member_id = f"B{str(uuid.uuid4().hex[:8]).upper()}"
+        username_taken = False
+        for conflict_email, conflict_username in User.objects.filter(
+            Q(email__iexact=email) | Q(username=base_username)
+        ).values_list('email', 'username'):
+            if conflict_email.lower() == email:
+                return Response({
+                    'success': False,
+                    'error': 'このメールアドレスは既に登録されています'
+                }, status=status.HTTP_400_BAD_REQUEST)
+            username_taken = username_taken or conflict_username == base_username
         
         # 直接登録ユーザーはブロンズランクでスタート
-        user = User.objects.create_user(
-            username=username,
-            email=email,
-            password=password,
-            first_name=first_name,
-            last_name=last_name,
-            member_id=member_id,
-            rank='bronze',  # 直接登録はブロンズランク
-            registration_source='direct',
-            is_active=True
-        )
-        
-        # 基本ウェルカムボーナス（ブロンズランク）
-        user.add_points(
-            points=500,
-            expiry_months=6,
-            source_description="biid新規登録ウェルカムボーナス"
-        )
+        # username/member_idは一意制約に任せ、違反時のみ再生成して再試行
+        username = f"{base_username}_{secrets.token_hex(3)}" if username_taken else base_username
+        for attempt in range(REGISTRATION_MAX_ATTEMPTS):
+            member_id = f"B{uuid.uuid4().hex[:8].upper()}"
+            try:
+                with transaction.atomic():
+                    user = User.objects.create_user(
+                        username=username,
+                        email=email,
+                        password=password,
+                        first_name=first_name,
+                        last_name=last_name,
+                        member_id=member_id,
+                        rank='bronze',  # 直接登録はブロンズランク
+                        registration_source='direct',
+                        is_active=True
+                    )
+                    
+                    # 基本ウェルカムボーナス（ブロンズランク）
+                    # 新規ユーザーの残高は0のため、残高集計を行わずユーザー作成と同一トランザクションで付与
+                    UserPoint.objects.create(
+                        user=user,
+                        points=DIRECT_WELCOME_BONUS_POINTS,
+                        expiry_date=timezone.now() + timedelta(days=30 * 6)
+                    )
+                    PointTransaction.objects.create(
+                        user=user,
+                        points=DIRECT_WELCOME_BONUS_POINTS,
+                        transaction_type='grant',
+                        description="biid新規登録ウェルカムボーナス",
+                        balance_before=0,
+                        balance_after=DIRECT_WELCOME_BONUS_POINTS
+                    )
+                break
+            except IntegrityError:
+                if attempt == REGISTRATION_MAX_ATTEMPTS - 1:
+                    raise
+                username = f"{base_username}_{secrets.token_hex(3)}"
+        
+        # ランクアップチェック（add_points() と同様）
+        user.check_and_update_rank()
         
         # Django認証
         login(request, user)
         
-        # ユーザー情報をシリアライズ
-        serializer = UserSerializer(user)
+        # レスポンス用のユーザー情報
+        user_data = _user_response_data(user)
         
-        logger.info(f"New direct registration: {user.username} (Bronze rank)")
+        logger.info("New direct registration: %s (Bronze rank)", user.username)
         
         return Response({
             'success': True,
-            'user': serializer.data,
+            'user': user_data,
             'is_new_user': True,
             'rank': user.rank,
-            'welcome_bonus': 500,
+            'welcome_bonus': DIRECT_WELCOME_BONUS_POINTS,
             'message': 'biidアカウントの作成が完了しました'
         }, status=status.HTTP_201_CREATED)
         
     except Exception as e:
-        logger.error(f"Direct registration failed: {str(e)}")
+        logger.error("Direct registration failed: %s", e)
         return Response({
             'success': False,
             'error': '登録処理中にエラーが発生しました'
@@ -248,7 +316,7 @@ def link_melty_account(request):
             }, status=status.HTTP_400_BAD_REQUEST)
         
         # meltyアカウント情報を取得してリンク
-        token_data = melty_user_service.api_client.exchange_code_for_token(melty_code)
+        token_data = get_melty_user_service().api_client.exchange_code_for_token(melty_code)
         access_token = token_data.get('access_token')
         
         if not access_token:
@@ -257,28 +325,45 @@ def link_melty_account(request):
                 'error': 'melty認証に失敗しました'
             }, status=status.HTTP_400_BAD_REQUEST)
         
-        melty_profile = melty_user_service.api_client.get_user_profile(access_token)
+        melty_profile = get_melty_user_service().api_client.get_user_profile_with_session(access_token)
         melty_user_id = melty_profile.get('user_id')
         
-        # 他のユーザーが同じmeltyアカウントを使用していないかチェック
-        if User.objects.filter(melty_user_id=melty_user_id).exists():
+        if not melty_user_id:
             return Response({
                 'success': False,
-                'error': 'このmeltyアカウントは既に他のbiidアカウントとリンクされています'
+                'error': 'meltyユーザーIDを取得できませんでした'
             }, status=status.HTTP_400_BAD_REQUEST)
         
-        # リンク実行
-        melty_user_service.link_melty_to_existing_user(user, melty_user_id, melty_profile)
+        # 未連携の場合のみ条件付きUPDATEで連携を確保する（melty_user_idのUNIQUE制約で他アカウントとの重複も防止）
+        with transaction.atomic():
+            try:
+                with transaction.atomic():
+                    claimed = User.objects.filter(pk=user.pk, is_melty_linked=False).update(
+                        melty_user_id=melty_user_id, is_melty_linked=True
+                    )
+            except IntegrityError:
+                return Response({
+                    'success': False,
+                    'error': 'このmeltyアカウントは既に他のbiidアカウントとリンクされています'
+                }, status=status.HTTP_400_BAD_REQUEST)
+            
+            if not claimed:
+                return Response({
+                    'success': False,
+                    'error': '既にmeltyアカウントとリンクされています'
+                }, status=status.HTTP_400_BAD_REQUEST)
+            
+            # ランク判定に必要な列のみ最新化してリンク実行（更新済みのインスタンスが返る）
+            user.refresh_from_db(fields=['rank'])
+            user = get_melty_user_service().link_melty_to_existing_user(user, melty_user_id, melty_profile)
         
-        # ユーザー情報を更新して返す
-        user.refresh_from_db()
-        serializer = UserSerializer(user)
+        user_data = _user_response_data(user)
         
         rank_upgrade = user.rank == 'silver'
         
         return Response({
             'success': True,
-            'user': serializer.data,
+            'user': user_data,
             'rank_upgraded': rank_upgrade,
             'new_rank': user.rank,
             'welcome_bonus': 1000 if rank_upgrade else 0,
@@ -291,7 +376,7 @@ def link_melty_account(request):
             'error': str(e)
         }, status=status.HTTP_400_BAD_REQUEST)
     except Exception as e:
-        logger.error(f"melty account linking failed: {str(e)}")
+        logger.error("melty account linking failed: %s", e)
         return Response({
             'success': False,
             'error': 'リンク処理中にエラーが発生しました'
@@ -311,10 +396,10 @@ def unlink_melty_account(request):
             }, status=status.HTTP_400_BAD_REQUEST)
         
         # リンク解除
-        success = melty_user_service.unlink_melty_account(user)
+        success = get_melty_user_service().unlink_melty_account(user)
         
         if success:
-            user.refresh_from_db()
+            # サービス側でuserインスタンスを更新済みのため再読込は不要
             serializer = UserSerializer(user)
             
             return Response({
@@ -329,7 +414,7 @@ def unlink_melty_account(request):
             }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
             
     except Exception as e:
-        logger.error(f"melty account unlinking failed: {str(e)}")
+        logger.error("melty account unlinking failed: %s", e)
         return Response({
             'success': False,
             'error': 'リンク解除処理中にエラーが発生しました'
@@ -359,7 +444,7 @@ def melty_profile_sync(request):
         })
         
     except Exception as e:
-        logger.error(f"melty profile sync failed: {str(e)}")
+        logger.error("melty profile sync failed: %s", e)
         return Response({
             'success': False,
             'error': 'プロフィール同期中にエラーが発生しました'
@@ -0,0 +1,17 @@
+# Generated by Django 4.2 on 2026-10-16 10:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_add_new_settings_models'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='paymenttransaction',
+            index=models.Index(fields=['customer', 'payment_method', '-created_at'], name='core_paymen_custome_135ad1_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2 on 2026-10-16 10:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_paymenttransaction_history_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='userpoint',
+            index=models.Index(condition=models.Q(('is_expired', False)), fields=['expiry_date'], name='userpoint_active_expiry_idx'),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 4.2 on 2026-10-16 12:00
+# 5カテゴリ設定モデルの単一行（pk=1）を初期投入し、初回アクセス時のINSERTを不要にする
+
+from django.core.management.color import no_style
+from django.db import migrations
+
+
+SETTINGS_MODEL_NAMES = [
+    'SystemInfrastructureSettings',
+    'SecuritySettings',
+    'ExternalIntegrationSettings',
+    'NotificationSettings',
+    'BusinessOperationSettings',
+    'UserExperienceSettings',
+]
+
+
+def seed_settings_singletons(apps, schema_editor):
+    """各設定モデルの既定値行を投入（既存行があれば何もしない）"""
+    models = [apps.get_model('core', model_name) for model_name in SETTINGS_MODEL_NAMES]
+    for model in models:
+        model.objects.bulk_create([model(pk=1)], ignore_conflicts=True)
+    
+    # pk明示のINSERTではPostgreSQLのidシーケンスが進まないため、既存行の最大値に合わせる（SQLiteでは不要）
+    connection = schema_editor.connection
+    with connection.cursor() as cursor:
+        for sql in connection.ops.sequence_reset_sql(no_style(), models):
+            cursor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_user_email_upper_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(seed_settings_singletons, migrations.RunPython.noop),
+    ]
@@ -1,7 +1,9 @@
 from django.db import models
+from django.core.cache import cache
 from django.contrib.auth.models import AbstractUser
 from django.utils import timezone
 from django.db.models import Sum
+from django.db.models.functions import Upper
 from django.core.validators import MinValueValidator, MaxValueValidator, EmailValidator
 
 
@@ -205,6 +207,12 @@ class User(AbstractUser):
         help_text="List of unlocked social skin themes"
     )
     
+    class Meta(AbstractUser.Meta):
+        indexes = [
+            # 大文字小文字を区別しないメールアドレス検索（email__iexact）用
+            models.Index(Upper('email'), name='user_email_upper_idx'),
+        ]
+    
     def __str__(self):
         return f"{self.username} ({self.member_id}) - {self.role}"
     
@@ -810,6 +818,10 @@ class UserPoint(models.Model):
     
     class Meta:
         ordering = ['expiry_date']
+        indexes = [
+            # 失効バッチ用（未失効の行のみを対象とする部分インデックス）
+            models.Index(fields=['expiry_date'], condition=models.Q(is_expired=False), name='userpoint_active_expiry_idx'),
+        ]
     
     def __str__(self):
         return f"{self.user.username} - {self.points}pt - 期限: {self.expiry_date}"
@@ -1152,7 +1164,93 @@ class StoreWebhookKey(models.Model):
 # 新5カテゴリ統合設定モデル - 本番運用仕様
 # ============================================
 
-class SystemInfrastructureSettings(models.Model):
+# 設定行のキャッシュ保持時間（秒）
+SETTINGS_CACHE_TIMEOUT = 30
+
+
+class CachedSettingsQuerySet(models.QuerySet):
+    """一括更新・一括削除（管理画面の一括操作を含む）でもキャッシュを破棄するQuerySet"""
+
+    def update(self, **kwargs):
+        rows = super().update(**kwargs)
+        self.model.objects.clear_cached()
+        return rows
+
+    def delete(self):
+        result = super().delete()
+        self.model.objects.clear_cached()
+        return result
+
+
+class CachedSettingsManager(models.Manager.from_queryset(CachedSettingsQuerySet)):
+    """
+    単一行（pk=1）設定モデル用マネージャー
+    行の列値を共有キャッシュに保持し、全ワーカーでリクエスト毎の設定読込クエリを省く
+    キャッシュキーには世代番号を含め、更新時は世代番号の繰り上げで全ワーカーのキャッシュを一斉に無効化する
+    （Redisキャッシュは JSON シリアライザのため、インスタンスではなく列値を保持して復元時に型変換する）
+    """
+
+    def _version_key(self):
+        return f"settings:{self.model._meta.label_lower}:version"
+
+    def _entry_key(self):
+        version = cache.get(self._version_key())
+        if version is None:
+            cache.add(self._version_key(), 1, None)
+            version = cache.get(self._version_key(), 1)
+        return f"settings:{self.model._meta.label_lower}:v{version}"
+
+    def get_solo(self):
+        fields = self.model._meta.concrete_fields
+        key = self._entry_key()
+        data = cache.get(key)
+        if data is not None:
+            return self.model.from_db(
+                self.db,
+                [field.attname for field in fields],
+                [field.to_python(data[field.attname]) for field in fields]
+            )
+
+        settings, created = self.get_or_create(pk=1)
+        # 日時はJSONエンコーダーでミリ秒に丸められないよう、ISO形式へ変換してから保持する
+        data = {}
+        for field in fields:
+            value = field.value_from_object(settings)
+            data[field.attname] = value.isoformat() if hasattr(value, 'isoformat') else value
+        cache.set(key, data, SETTINGS_CACHE_TIMEOUT)
+        return settings
+
+    def clear_cached(self):
+        # 世代番号を繰り上げ、更新前に読み込まれた値が書き戻されても参照されないようにする
+        cache.add(self._version_key(), 1, None)
+        try:
+            cache.incr(self._version_key())
+        except ValueError:
+            cache.set(self._version_key(), 2, None)
+
+
+class SingletonSettingsModel(models.Model):
+    """5カテゴリ設定モデル共通基底（保存・削除時に共有キャッシュを無効化）"""
+    objects = CachedSettingsManager()
+
+    class Meta:
+        abstract = True
+
+    @classmethod
+    def get_settings(cls):
+        return cls.objects.get_solo()
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        type(self).objects.clear_cached()
+
+    def delete(self, *args, **kwargs):
+        result = super().delete(*args, **kwargs)
+        type(self).objects.clear_cached()
+        return result
+
+
+class SystemInfrastructureSettings(SingletonSettingsModel):
     """🏗️ システム基盤設定"""
     site_name = models.CharField(
         max_length=100, 
@@ -1230,11 +1328,6 @@ class SystemInfrastructureSettings(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
     updated_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, verbose_name="更新者")
 
-    @classmethod
-    def get_settings(cls):
-        settings, created = cls.objects.get_or_create(pk=1)
-        return settings
-
     def get_system_info(self):
         return {
             'site_name': self.site_name,
@@ -1250,7 +1343,7 @@ class SystemInfrastructureSettings(models.Model):
         db_table = 'core_system_infrastructure_settings'
 
 
-class SecuritySettings(models.Model):
+class SecuritySettings(SingletonSettingsModel):
     """🔒 セキュリティ設定"""
     max_login_attempts = models.IntegerField(
         default=5,
@@ -1306,11 +1399,6 @@ class SecuritySettings(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
-    @classmethod
-    def get_settings(cls):
-        settings, created = cls.objects.get_or_create(pk=1)
-        return settings
-
     def get_security_policy(self):
         return {
             'max_attempts': self.max_login_attempts,
@@ -1326,7 +1414,7 @@ class SecuritySettings(models.Model):
         db_table = 'core_security_settings'
 
 
-class ExternalIntegrationSettings(models.Model):
+class ExternalIntegrationSettings(SingletonSettingsModel):
     """🔗 決済・外部連携設定"""
     # FINCODE設定
     fincode_api_key = models.CharField(
@@ -1427,11 +1515,6 @@ class ExternalIntegrationSettings(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
-    @classmethod
-    def get_settings(cls):
-        settings, created = cls.objects.get_or_create(pk=1)
-        return settings
-
     def get_fincode_config(self):
         return {
             'api_key': self.fincode_api_key,
@@ -1449,7 +1532,7 @@ class ExternalIntegrationSettings(models.Model):
         db_table = 'core_external_integration_settings'
 
 
-class NotificationSettings(models.Model):
+class NotificationSettings(SingletonSettingsModel):
     """📧 通知・メール設定"""
     # SMTP設定
     smtp_host = models.CharField(
@@ -1566,11 +1649,6 @@ class NotificationSettings(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
-    @classmethod
-    def get_settings(cls):
-        settings, created = cls.objects.get_or_create(pk=1)
-        return settings
-
     def get_smtp_config(self):
         return {
             'host': self.smtp_host,
@@ -1589,7 +1667,7 @@ class NotificationSettings(models.Model):
         db_table = 'core_notification_settings'
 
 
-class BusinessOperationSettings(models.Model):
+class BusinessOperationSettings(SingletonSettingsModel):
     """💼 事業運営設定"""
     # ポイントシステム基本設定
     default_point_rate = models.DecimalField(
@@ -1712,11 +1790,6 @@ class BusinessOperationSettings(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
-    @classmethod
-    def get_settings(cls):
-        settings, created = cls.objects.get_or_create(pk=1)
-        return settings
-
     def get_fee_structure(self):
         return {
             'system_fee_rate': float(self.system_fee_rate),
@@ -1733,7 +1806,7 @@ class BusinessOperationSettings(models.Model):
         db_table = 'core_business_operation_settings'
 
 
-class UserExperienceSettings(models.Model):
+class UserExperienceSettings(SingletonSettingsModel):
     """👤 ユーザー体験設定"""
     # ユーザーサポート設定
     user_support_email = models.EmailField(
@@ -1839,11 +1912,6 @@ class UserExperienceSettings(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
-    @classmethod
-    def get_settings(cls):
-        settings, created = cls.objects.get_or_create(pk=1)
-        return settings
-
     def get_user_support_info(self):
         return {
             'email': self.user_support_email,
@@ -2974,6 +3042,7 @@ class PaymentTransaction(models.Model):
         ordering = ['-created_at']
         indexes = [
             models.Index(fields=['customer', '-created_at']),
+            models.Index(fields=['customer', 'payment_method', '-created_at']),
             models.Index(fields=['store', '-created_at']),
             models.Index(fields=['status', 'created_at']),
             models.Index(fields=['transaction_id']),
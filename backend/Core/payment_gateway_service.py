@@ -3,7 +3,7 @@
 from django.conf import settings
 from typing import Dict, Any, Optional
 import logging
-from .fincode_service import fincode_service, FINCODEError
+from .fincode_service import get_fincode_service, FINCODEError
 
 logger = logging.getLogger(__name__)
 
@@ -22,9 +22,13 @@ class PaymentGatewayService:
     def __init__(self):
         """FINCODE決済サービスを初期化"""
         self.gateway = "fincode"
-        self.service = fincode_service
         logger.info("PaymentGatewayService initialized with FINCODE")
 
+    @property
+    def service(self):
+        """FINCODEサービス（初回アクセス時に生成）"""
+        return get_fincode_service()
+
     def initiate_payment(self, payment_data: Dict[str, Any]) -> Dict[str, Any]:
         """決済開始"""
         try:
@@ -17,6 +17,7 @@ class PointService:
         self.transfer_fee_rate = Decimal('0.10')  # 転送手数料率（10%）
         self.min_transfer_amount = 100  # 最小転送ポイント
         self.max_transfer_amount = 50000  # 最大転送ポイント
+        self.expire_batch_size = 1000  # 失効処理の1チャンクあたり件数
     
     @transaction.atomic
     def grant_points_to_user(self, user: User, points: int, store: Store = None, 
@@ -180,38 +181,63 @@ class PointService:
             raise
     
     def check_expired_points(self):
-        """期限切れポイントをチェックして無効化"""
+        """期限切れポイントをチェックして無効化（チャンク単位で一括処理）"""
         try:
             expired_points = UserPoint.objects.filter(
                 expiry_date__lt=timezone.now(),
                 is_expired=False
-            )
+            ).only('id', 'user_id', 'points', 'expiry_date').order_by('id')
             
             expired_count = 0
-            for user_point in expired_points:
-                # 失効ポイントの取引履歴記録
-                PointTransaction.objects.create(
-                    user=user_point.user,
-                    points=-user_point.points,
-                    transaction_type='expire',
-                    description=f"ポイント失効: {user_point.points}pt（期限: {user_point.expiry_date}）",
-                    balance_before=user_point.user.point_balance,
-                    balance_after=user_point.user.point_balance - user_point.points
-                )
+            while True:
+                # 処理済みチャンクは is_expired=True になるため、毎回先頭から取得すればよい
+                chunk = list(expired_points[:self.expire_batch_size])
+                if not chunk:
+                    break
                 
-                # 失効通知
-                Notification.objects.create(
-                    user=user_point.user,
-                    notification_type='system',
-                    title='ポイントが失効しました',
-                    message=f'{user_point.points}ポイントが有効期限切れで失効しました。',
-                    priority='normal'
-                )
+                with transaction.atomic():
+                    # ユーザーごとの現在の有効残高（失効処理に応じて順次減算）
+                    balances = dict(
+                        UserPoint.objects.filter(
+                            user_id__in={user_point.user_id for user_point in chunk},
+                            is_expired=False
+                        ).values('user_id').annotate(total=Sum('points')).values_list('user_id', 'total')
+                    )
+                    
+                    point_transactions = []
+                    notifications = []
+                    for user_point in chunk:
+                        balance_before = balances.get(user_point.user_id) or 0
+                        balances[user_point.user_id] = balance_before - user_point.points
+                        
+                        # 失効ポイントの取引履歴記録
+                        point_transactions.append(PointTransaction(
+                            user_id=user_point.user_id,
+                            points=-user_point.points,
+                            transaction_type='expire',
+                            description=f"ポイント失効: {user_point.points}pt（期限: {user_point.expiry_date}）",
+                            balance_before=balance_before,
+                            balance_after=balance_before - user_point.points
+                        ))
+                        
+                        # 失効通知
+                        notifications.append(Notification(
+                            user_id=user_point.user_id,
+                            notification_type='system',
+                            title='ポイントが失効しました',
+                            message=f'{user_point.points}ポイントが有効期限切れで失効しました。',
+                            priority='normal'
+                        ))
+                    
+                    PointTransaction.objects.bulk_create(point_transactions)
+                    Notification.objects.bulk_create(notifications)
+                    
+                    # ポイント無効化
+                    UserPoint.objects.filter(
+                        id__in=[user_point.id for user_point in chunk]
+                    ).update(is_expired=True)
                 
-                # ポイント無効化
-                user_point.is_expired = True
-                user_point.save()
-                expired_count += 1
+                expired_count += len(chunk)
             
             logger.info(f"Expired points processed: {expired_count} point records")
             return expired_count
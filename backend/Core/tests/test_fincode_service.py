@@ -0,0 +1,206 @@
+"""FINCODE決済サービスのテスト"""
+
+from decimal import Decimal
+from unittest import mock
+
+import orjson
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import RequestFactory, TestCase, override_settings
+
+from core.fincode_service import FINCODEService, get_fincode_service
+from core.fincode_views import payment_notify
+from core.models import PaymentTransaction, Store
+
+User = get_user_model()
+
+
+@override_settings(FINCODE_MOCK_FAST=True)
+class InitiatePaymentBatchTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.service = FINCODEService()
+        self.customer = User.objects.create_user(username='customer1', password='x', member_id='C0001')
+        self.store = Store.objects.create(
+            name='テスト店舗', owner_name='店主', email='store@example.com', phone='0000', address='大阪'
+        )
+
+    def _payment(self, order_id, **extra):
+        data = {
+            'order_id': order_id,
+            'amount': 1500,
+            'payment_method': 'card',
+            'customer_id': self.customer.member_id,
+            'store_id': self.store.pk,
+        }
+        data.update(extra)
+        return data
+
+    def test_known_customer_payments_are_recorded(self):
+        results = self.service.initiate_payment_batch([self._payment('ORD-1'), self._payment('ORD-2')])
+
+        self.assertEqual([r['order_id'] for r in results], ['ORD-1', 'ORD-2'])
+        self.assertTrue(all(r['success'] for r in results))
+        records = PaymentTransaction.objects.filter(customer=self.customer).order_by('fincode_order_id')
+        self.assertEqual([t.fincode_order_id for t in records], ['ORD-1', 'ORD-2'])
+        self.assertEqual(records[0].total_amount, Decimal('1500'))
+        self.assertEqual(records[0].store_id, self.store.pk)
+        self.assertTrue(all(r['db_transaction_id'] for r in results))
+
+    def test_record_failure_keeps_single_successful_result(self):
+        results = self.service.initiate_payment_batch([self._payment('ORD-3', store_id=None)])
+
+        self.assertEqual(len(results), 1)
+        self.assertTrue(results[0]['success'])
+        self.assertIsNone(results[0]['db_transaction_id'])
+        self.assertFalse(PaymentTransaction.objects.exists())
+
+
+@override_settings(FINCODE_MOCK_FAST=True)
+class CheckPaymentStatusTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.service = FINCODEService()
+        customer = User.objects.create_user(username='customer1', password='x', member_id='C0001')
+        store = Store.objects.create(
+            name='テスト店舗', owner_name='店主', email='store@example.com', phone='0000', address='大阪'
+        )
+        self.transaction = PaymentTransaction.objects.create(
+            transaction_id='FINCODE-ORD-1', customer=customer, store=store, payment_method='card',
+            total_amount=1000, fincode_payment_id='pay_1', fincode_order_id='ORD-1'
+        )
+        captured = mock.patch.object(self.service, '_build_mock_response', return_value={
+            'id': 'pay_1', 'order_id': 'ORD-1', 'amount': 1000, 'status': 'CAPTURED',
+            'pay_type': 'card', 'created': '2026-10-16T12:00:00', 'updated': '2026-10-16T12:00:01',
+        })
+        captured.start()
+        self.addCleanup(captured.stop)
+
+    def test_completion_is_written_when_cache_is_unavailable(self):
+        # IGNORE_EXCEPTIONS有効時、Redis障害中の cache.add() は None を返す
+        with mock.patch('core.fincode_service.cache.add', return_value=None):
+            result = self.service.check_payment_status('pay_1')
+
+        self.assertEqual(result['status'], 'completed')
+        self.transaction.refresh_from_db()
+        self.assertEqual(self.transaction.status, 'completed')
+
+    def test_completion_recorded_by_another_worker_is_not_rewritten(self):
+        with mock.patch('core.fincode_service.cache.add', return_value=False):
+            self.service.check_payment_status('pay_1')
+
+        self.transaction.refresh_from_db()
+        self.assertEqual(self.transaction.status, 'pending')
+
+    def test_cached_completion_is_served_without_api_call(self):
+        self.service.check_payment_status('pay_1')
+
+        with mock.patch.object(self.service, '_mock_fincode_response') as api:
+            result = self.service.check_payment_status('pay_1')
+
+        api.assert_not_called()
+        self.assertEqual(
+            (result['status'], result['order_id'], result['amount']), ('completed', 'ORD-1', 1000)
+        )
+
+    def test_unrecognized_cached_status_falls_back_to_api(self):
+        # デプロイ前の形式（辞書）や壊れた値が残っていても失敗扱いにしない
+        cache.set('fincode_status_pay_1', {'success': True, 'status': 'completed'}, 60)
+        cache.set('fincode_status:v2:pay_1', {'status': 'completed'}, 60)
+
+        result = self.service.check_payment_status('pay_1')
+
+        self.assertTrue(result['success'])
+        self.assertEqual(result['status'], 'completed')
+        self.assertEqual(result['order_id'], 'ORD-1')
+        self.transaction.refresh_from_db()
+        self.assertEqual(self.transaction.status, 'completed')
+
+    def test_failed_db_write_is_retried_on_next_check(self):
+        with mock.patch.object(PaymentTransaction.objects, 'filter', side_effect=RuntimeError('db down')):
+            self.service.check_payment_status('pay_1')
+
+        self.service.check_payment_status('pay_1')
+
+        self.transaction.refresh_from_db()
+        self.assertEqual(self.transaction.status, 'completed')
+
+
+@override_settings(FINCODE_MOCK_FAST=True)
+class PaymentPollStateTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.service = get_fincode_service()
+        self.fincode_status = 'AUTHORIZED'
+        response = mock.patch.object(self.service, '_build_mock_response', side_effect=lambda operation, data: {
+            'id': 'pay_1', 'order_id': 'ORD-1', 'amount': 1000, 'status': self.fincode_status,
+            'pay_type': 'card', 'created': '2026-10-16T12:00:00', 'updated': '2026-10-16T12:00:01',
+        })
+        response.start()
+        self.addCleanup(response.stop)
+
+    def test_pending_result_is_served_during_backoff(self):
+        self.assertEqual(self.service.check_payment_status('pay_1')['status'], 'processing')
+        self.fincode_status = 'CAPTURED'
+
+        self.assertEqual(self.service.check_payment_status('pay_1')['status'], 'processing')
+        self.assertEqual(cache.get('fincode_poll_attempt_pay_1'), 1)
+
+    def test_webhook_clears_backoff_state(self):
+        self.service.check_payment_status('pay_1')
+        self.fincode_status = 'CAPTURED'
+
+        request = RequestFactory().post(
+            '/api/fincode/notify/', orjson.dumps({'id': 'pay_1', 'status': 'CAPTURED'}),
+            content_type='application/json'
+        )
+        payment_notify(request)
+
+        self.assertIsNone(cache.get('fincode_poll_attempt_pay_1'))
+        self.assertEqual(self.service.check_payment_status('pay_1')['status'], 'completed')
+
+    def test_terminal_status_clears_backoff_state(self):
+        self.service.check_payment_status('pay_1')
+        cache.delete('fincode_next_poll_pay_1')  # バックオフ期間の経過
+        self.fincode_status = 'CANCELED'
+
+        self.assertEqual(self.service.check_payment_status('pay_1')['status'], 'cancelled')
+        self.assertIsNone(cache.get('fincode_poll_attempt_pay_1'))
+        self.assertIsNone(cache.get('fincode_next_poll_pay_1'))
+
+
+@override_settings(FINCODE_MOCK_FAST=True)
+class RefundPaymentTests(TestCase):
+    def setUp(self):
+        self.service = FINCODEService()
+        customer = User.objects.create_user(username='customer1', password='x', member_id='C0001')
+        store = Store.objects.create(
+            name='テスト店舗', owner_name='店主', email='store@example.com', phone='0000', address='大阪'
+        )
+        self.original = PaymentTransaction.objects.create(
+            transaction_id='FINCODE-ORD-1', customer=customer, store=store, payment_method='card',
+            total_amount=3000, status='completed', fincode_payment_id='pay_1', fincode_order_id='ORD-1',
+            terminal_id='T-1'
+        )
+
+    def test_refund_is_recorded_against_original_payment(self):
+        result = self.service.refund_payment('pay_1', 1200, 'customer request')
+
+        self.assertTrue(result['success'])
+        refund = PaymentTransaction.objects.get(transaction_type='refund')
+        self.assertEqual(refund.total_amount, Decimal('-1200'))
+        self.assertTrue(refund.transaction_id.startswith('FINCODE-REFUND-'))
+        self.assertEqual(refund.payment_method, 'card')
+        self.assertEqual(refund.status, 'completed')
+        self.assertEqual(
+            (refund.customer_id, refund.store_id, refund.terminal_id),
+            (self.original.customer_id, self.original.store_id, 'T-1'),
+        )
+        self.assertEqual(refund.metadata['original_payment_id'], 'pay_1')
+        self.assertEqual(refund.metadata['original_transaction_pk'], self.original.pk)
+
+    def test_repeated_refunds_get_distinct_records(self):
+        self.service.refund_payment('pay_1', 500)
+        self.service.refund_payment('pay_1', 500)
+
+        self.assertEqual(PaymentTransaction.objects.filter(transaction_type='refund').count(), 2)
@@ -0,0 +1,144 @@
+"""FINCODE Webhook受信ビューのテスト"""
+
+from unittest import mock
+
+import orjson
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import RequestFactory, TestCase, override_settings
+from django.utils import timezone
+
+from core.fincode_views import get_transaction_history, payment_notify
+from core.models import PaymentTransaction, Store
+from core.serializers import PaymentTransactionSerializer
+
+User = get_user_model()
+
+
+class PaymentNotifySignatureTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.factory = RequestFactory()
+
+    def _notify(self, body=None, signature=None):
+        headers = {'Fincode-Signature': signature} if signature is not None else {}
+        request = self.factory.post(
+            '/api/fincode/notify/', orjson.dumps(body or {}), content_type='application/json', headers=headers
+        )
+        return payment_notify(request)
+
+    @override_settings(FINCODE_WEBHOOK_SIGNATURE='wh-sig-0123456789')
+    def test_registered_signature_is_accepted(self):
+        self.assertEqual(self._notify(signature='wh-sig-0123456789').status_code, 200)
+
+    @override_settings(FINCODE_WEBHOOK_SIGNATURE='wh-sig-0123456789')
+    def test_wrong_or_missing_signature_is_rejected(self):
+        self.assertEqual(self._notify(signature='wh-sig-000000000').status_code, 401)
+        self.assertEqual(self._notify().status_code, 401)
+
+    @override_settings(FINCODE_WEBHOOK_SIGNATURE='', FINCODE_SECRET_KEY='api-secret')
+    def test_verification_is_off_unless_webhook_signature_is_set(self):
+        self.assertEqual(self._notify().status_code, 200)
+
+
+class PaymentNotifyUpdateTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.factory = RequestFactory()
+        customer = User.objects.create_user(username='payer', password='x', member_id='P0001')
+        store = Store.objects.create(
+            name='テスト店舗', owner_name='店主', email='store@example.com', phone='0000', address='大阪'
+        )
+        self.transaction = PaymentTransaction.objects.create(
+            transaction_id='FINCODE-ORD-1', customer=customer, store=store, payment_method='card',
+            total_amount=1000, fincode_payment_id='pay_1', fincode_order_id='ORD-1'
+        )
+
+    def _notify(self, status):
+        request = self.factory.post(
+            '/api/fincode/notify/', orjson.dumps({'id': 'pay_1', 'status': status, 'order_id': 'ORD-1'}),
+            content_type='application/json'
+        )
+        return orjson.loads(payment_notify(request).content)
+
+    def test_captured_webhook_completes_transaction_in_one_update(self):
+        with self.assertNumQueries(3):  # SAVEPOINT / UPDATE / RELEASE
+            self._notify('CAPTURED')
+
+        self.transaction.refresh_from_db()
+        self.assertEqual(self.transaction.status, 'completed')
+        self.assertIsNotNone(self.transaction.completed_at)
+        self.assertTrue(self.transaction.receipt_number.endswith(f'-{self.transaction.pk}'))
+
+    def test_repeat_completion_keeps_first_completion_values(self):
+        self._notify('CAPTURED')
+        self.transaction.refresh_from_db()
+        completed_at, receipt_number = self.transaction.completed_at, self.transaction.receipt_number
+        cache.clear()
+
+        self._notify('CAPTURED')
+
+        self.transaction.refresh_from_db()
+        self.assertEqual(self.transaction.completed_at, completed_at)
+        self.assertEqual(self.transaction.receipt_number, receipt_number)
+
+    def test_duplicate_webhook_is_acknowledged_without_update(self):
+        self._notify('AUTHORIZED')
+
+        with self.assertNumQueries(0):
+            response = self._notify('AUTHORIZED')
+
+        self.assertTrue(response['deduped'])
+
+    def test_failed_update_releases_dedupe_key_for_redelivery(self):
+        with mock.patch.object(PaymentTransaction.objects, 'filter', side_effect=RuntimeError('db down')):
+            self._notify('CAPTURED')
+
+        response = self._notify('CAPTURED')
+
+        self.assertNotIn('deduped', response)
+        self.transaction.refresh_from_db()
+        self.assertEqual(self.transaction.status, 'completed')
+
+    def test_unavailable_cache_does_not_swallow_webhook(self):
+        # IGNORE_EXCEPTIONS有効時、Redis障害中の cache.add() は None を返す
+        with mock.patch('core.fincode_views.cache.add', return_value=None):
+            response = self._notify('CAPTURED')
+
+        self.assertNotIn('deduped', response)
+        self.transaction.refresh_from_db()
+        self.assertEqual(self.transaction.status, 'completed')
+
+    def test_webhook_before_transaction_row_is_not_deduped(self):
+        PaymentTransaction.objects.filter(pk=self.transaction.pk).update(fincode_payment_id='pay_later')
+
+        self._notify('CAPTURED')
+        PaymentTransaction.objects.filter(pk=self.transaction.pk).update(fincode_payment_id='pay_1')
+        response = self._notify('CAPTURED')
+
+        self.assertNotIn('deduped', response)
+        self.transaction.refresh_from_db()
+        self.assertEqual(self.transaction.status, 'completed')
+
+
+class TransactionHistoryTests(TestCase):
+    def setUp(self):
+        customer = User.objects.create_user(username='payer', password='x', member_id='P0001')
+        store = Store.objects.create(
+            name='テスト店舗', owner_name='店主', email='store@example.com', phone='0000', address='大阪'
+        )
+        self.transaction = PaymentTransaction.objects.create(
+            transaction_id='FINCODE-ORD-1', customer=customer, store=store, payment_method='fincode',
+            total_amount=1000, status='completed', completed_at=timezone.now()
+        )
+
+    def test_datetimes_keep_serializer_format(self):
+        request = RequestFactory().get('/api/fincode/transactions/', {'customer_id': 'P0001'})
+        response = get_transaction_history(request)
+        body = orjson.loads(b''.join(response.streaming_content))
+
+        row = body['transactions'][0]
+        expected = PaymentTransactionSerializer(self.transaction).data
+        for field in ('created_at', 'updated_at', 'completed_at'):
+            self.assertTrue(row[field].endswith('Z'))
+            self.assertEqual(row[field], expected[field])
@@ -0,0 +1,235 @@
+"""melty連携サービスのテスト"""
+
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+
+from django.db.models.expressions import RawSQL
+
+from core.melty_integration import MeltyAPIClient, MeltyDirectAuth, MeltyIntegrationError, MeltyUserService
+
+User = get_user_model()
+
+
+class StubMeltyClient(MeltyAPIClient):
+    """セッショントークンごとのプロフィールを返すスタブクライアント"""
+
+    def __init__(self, profiles):
+        super().__init__(session=mock.Mock())
+        self.profiles = profiles
+
+    def get_user_profile_with_session(self, session_token):
+        profile = self.profiles.get(session_token)
+        if profile is None:
+            raise MeltyIntegrationError("Profile fetch failed: 401")
+        return profile
+
+
+def _linked_user(username, melty_user_id, **extra):
+    return User.objects.create_user(
+        username=username, password='x', member_id=f"S{melty_user_id}",
+        melty_user_id=melty_user_id, is_melty_linked=True, **extra
+    )
+
+
+class MeltyProfileSyncTests(TestCase):
+    def test_sync_melty_profile_updates_row(self):
+        user = _linked_user('hanako', 'm-1', melty_profile_data={'name': 'old'})
+        service = MeltyUserService(api_client=StubMeltyClient({
+            'tok-1': {'user_id': 'm-1', 'name': 'Hanako', 'email': 'hanako@melty.example'},
+        }))
+
+        self.assertTrue(service.sync_melty_profile(user, 'tok-1'))
+
+        user.refresh_from_db()
+        self.assertEqual(user.melty_profile_data['name'], 'Hanako')
+        self.assertEqual(user.melty_email, 'hanako@melty.example')
+
+    def test_bulk_sync_updates_fetched_rows_and_skips_failures(self):
+        ok = _linked_user('ok', 'm-2')
+        failing = _linked_user('failing', 'm-3', melty_profile_data={'name': 'keep'})
+        other_account = _linked_user('other', 'm-4', melty_profile_data={'name': 'keep'})
+        service = MeltyUserService(api_client=StubMeltyClient({
+            'tok-2': {'user_id': 'm-2', 'name': 'OK', 'email': 'ok@melty.example'},
+            'tok-4': {'user_id': 'm-999', 'name': 'Someone else'},
+        }))
+
+        synced = service.bulk_sync_melty_profiles([(ok, 'tok-2'), (failing, 'bad'), (other_account, 'tok-4')])
+
+        self.assertEqual(synced, 1)
+        ok.refresh_from_db()
+        failing.refresh_from_db()
+        other_account.refresh_from_db()
+        self.assertEqual(ok.melty_profile_data['name'], 'OK')
+        self.assertEqual(ok.melty_email, 'ok@melty.example')
+        self.assertEqual(failing.melty_profile_data, {'name': 'keep'})
+        self.assertEqual(other_account.melty_profile_data, {'name': 'keep'})
+
+    def test_bulk_sync_writes_every_batch(self):
+        users = [_linked_user(f'user{i}', f'm-1{i}') for i in range(3)]
+        service = MeltyUserService(api_client=StubMeltyClient({
+            f'tok-{i}': {'user_id': f'm-1{i}', 'name': f'User {i}'} for i in range(3)
+        }))
+
+        with mock.patch('core.melty_integration.MELTY_SYNC_BATCH_SIZE', 2):
+            synced = service.bulk_sync_melty_profiles([(user, f'tok-{i}') for i, user in enumerate(users)])
+
+        self.assertEqual(synced, 3)
+        names = dict(User.objects.filter(pk__in=[u.pk for u in users]).values_list('username', 'melty_profile_data__name'))
+        self.assertEqual(names, {'user0': 'User 0', 'user1': 'User 1', 'user2': 'User 2'})
+
+    def test_bulk_sync_without_fetched_profiles_skips_write(self):
+        user = _linked_user('nobody', 'm-5')
+        service = MeltyUserService(api_client=StubMeltyClient({}))
+
+        with self.assertNumQueries(0):
+            self.assertEqual(service.bulk_sync_melty_profiles([(user, 'expired')]), 0)
+
+
+class MeltyProfileDeltaTests(TestCase):
+    def setUp(self):
+        self.profile = {'user_id': 'm-20', 'name': 'Hanako', 'email': 'hanako@melty.example', 'tier': 'gold'}
+        self.user = _linked_user(
+            'delta', 'm-20', melty_profile_data=dict(self.profile), melty_email='hanako@melty.example'
+        )
+
+    def test_unchanged_profile_issues_no_update(self):
+        service = MeltyUserService(api_client=StubMeltyClient({'tok': dict(self.profile)}))
+
+        with self.assertNumQueries(0):
+            self.assertTrue(service.sync_melty_profile(self.user, 'tok'))
+
+    def test_changed_and_removed_keys_are_written(self):
+        profile = {'user_id': 'm-20', 'name': 'Hanako S', 'email': 'hanako@melty.example', 'city': 'Tokyo'}
+        service = MeltyUserService(api_client=StubMeltyClient({'tok': profile}))
+
+        with self.assertNumQueries(1):
+            self.assertTrue(service.sync_melty_profile(self.user, 'tok'))
+
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.melty_profile_data, profile)
+
+    def test_postgresql_patch_merges_only_delta(self):
+        service = MeltyUserService(api_client=StubMeltyClient({}))
+
+        with mock.patch('core.melty_integration.connection') as connection:
+            connection.vendor = 'postgresql'
+            merged = service._profile_patch_expression({'name': 'New', 'tier': 'gold'}, {'name': 'New'}, [])
+            pruned = service._profile_patch_expression({'name': 'New'}, {'name': 'New'}, ['tier'])
+
+        self.assertIsInstance(merged, RawSQL)
+        self.assertEqual(merged.sql, "COALESCE(melty_profile_data, '{}'::jsonb) || %s::jsonb")
+        self.assertEqual(merged.params, ['{"name":"New"}'])
+        self.assertEqual(pruned.sql, "(COALESCE(melty_profile_data, '{}'::jsonb) || %s::jsonb) - %s::text[]")
+        self.assertEqual(pruned.params, ['{"name":"New"}', ['tier']])
+
+    def test_other_backends_write_whole_profile(self):
+        service = MeltyUserService(api_client=StubMeltyClient({}))
+        profile = {'name': 'New'}
+
+        self.assertIs(service._profile_patch_expression(profile, profile, ['tier']), profile)
+
+
+class CreateBiidAccountFromMeltyTests(TestCase):
+    def setUp(self):
+        self.client_stub = StubMeltyClient({'tok': {'user_id': 'm-7', 'nickname': 'Jiro'}})
+        self.client_stub.verify_user_credentials = mock.Mock(return_value={
+            'verified': True, 'user_id': 'm-7', 'email': 'jiro@example.com', 'token': 'tok', 'user_data': {},
+        })
+        self.client_stub.get_user_profile_with_session = mock.Mock(
+            wraps=self.client_stub.get_user_profile_with_session
+        )
+        self.service = MeltyUserService(api_client=self.client_stub)
+
+    def test_new_user_fetches_detailed_profile(self):
+        user, is_new = self.service.create_biid_account_from_melty('jiro@example.com', 'Jiro', 'Sato', 'pw')
+
+        self.assertTrue(is_new)
+        self.assertEqual(user.melty_profile_data['nickname'], 'Jiro')
+        self.client_stub.get_user_profile_with_session.assert_called_once_with('tok')
+
+    def test_linked_user_skips_profile_fetch(self):
+        existing = _linked_user('jiro', 'm-7')
+
+        user, is_new = self.service.create_biid_account_from_melty('jiro@example.com', 'Jiro', 'Sato', 'pw')
+
+        self.assertFalse(is_new)
+        self.assertEqual(user.pk, existing.pk)
+        self.client_stub.get_user_profile_with_session.assert_not_called()
+
+
+class CreateNewBiidUserWithMeltyTests(TestCase):
+    def test_username_taken_concurrently_is_regenerated(self):
+        create_user = User.objects.create_user
+
+        def racing_create_user(**kwargs):
+            # 重複チェック後、INSERT前に同名ユーザーが作成された状況を再現
+            if not User.objects.filter(username='jiro_sato').exists():
+                create_user(username='jiro_sato', password='x', member_id='RACE0001')
+            return create_user(**kwargs)
+
+        service = MeltyUserService(api_client=StubMeltyClient({}))
+        with mock.patch.object(User.objects, 'create_user', side_effect=racing_create_user), \
+                mock.patch.object(service, 'grant_melty_welcome_bonus'):
+            user = service.create_new_biid_user_with_melty('jiro@example.com', 'Jiro', 'Sato', 'm-30', {})
+
+        self.assertRegex(user.username, r'^jiro_sato_[0-9a-f]{6}$')
+        self.assertEqual(user.melty_user_id, 'm-30')
+        self.assertEqual(User.objects.filter(melty_user_id='m-30').count(), 1)
+
+
+@override_settings(
+    MELTY_API_BASE_URL='https://melty.example/api', MELTY_OAUTH_AUTHORIZE_URL='https://melty.example/oauth/authorize',
+    MELTY_OAUTH_CLIENT_ID='biid',
+    MELTY_OAUTH_CLIENT_SECRET='client-secret', MELTY_OAUTH_REDIRECT_URI='https://biid.example/api/melty/callback/'
+)
+class MeltyOAuthFlowTests(TestCase):
+    def test_exchange_code_posts_authorization_code(self):
+        client = MeltyAPIClient(session=mock.Mock())
+        client.session.post.return_value = mock.Mock(status_code=200, content=b'{"access_token":"tok"}')
+
+        self.assertEqual(client.exchange_code_for_token('auth-code'), {'access_token': 'tok'})
+
+        url, data = client.session.post.call_args.args
+        self.assertEqual(url, 'https://melty.example/api/oauth/token')
+        self.assertEqual(data['grant_type'], 'authorization_code')
+        self.assertEqual((data['code'], data['client_id']), ('auth-code', 'biid'))
+        self.assertEqual(data['redirect_uri'], 'https://biid.example/api/melty/callback/')
+
+    def test_rejected_code_raises(self):
+        client = MeltyAPIClient(session=mock.Mock())
+        client.session.post.return_value = mock.Mock(status_code=400, content=b'{"error":"invalid_grant"}')
+
+        with self.assertRaises(MeltyIntegrationError):
+            client.exchange_code_for_token('used-code')
+
+    def test_auth_url_points_to_authorize_endpoint(self):
+        auth = MeltyDirectAuth(api_client=StubMeltyClient({}))
+
+        self.assertEqual(
+            auth.generate_auth_url('signed-state'),
+            'https://melty.example/oauth/authorize?response_type=code&client_id=biid'
+            '&redirect_uri=https%3A%2F%2Fbiid.example%2Fapi%2Fmelty%2Fcallback%2F&state=signed-state',
+        )
+
+    def test_handle_callback_returns_linked_user(self):
+        user = _linked_user('oauth', 'm-40')
+        client = StubMeltyClient({'tok': {'id': 'm-40'}})
+        client.exchange_code_for_token = mock.Mock(return_value={'access_token': 'tok'})
+
+        self.assertEqual(MeltyDirectAuth(api_client=client).handle_callback('auth-code', 'state'), (user, 'tok'))
+
+    def test_handle_callback_requires_registration_for_unlinked_user(self):
+        client = StubMeltyClient({'tok': {'user_id': 'm-41'}})
+        client.exchange_code_for_token = mock.Mock(return_value={'access_token': 'tok'})
+
+        with self.assertRaisesMessage(MeltyIntegrationError, 'registration required'):
+            MeltyDirectAuth(api_client=client).handle_callback('auth-code', 'state')
+
+    def test_handle_callback_without_access_token_raises(self):
+        client = StubMeltyClient({})
+        client.exchange_code_for_token = mock.Mock(return_value={'error': 'invalid_grant'})
+
+        with self.assertRaises(MeltyIntegrationError):
+            MeltyDirectAuth(api_client=client).handle_callback('auth-code', 'state')
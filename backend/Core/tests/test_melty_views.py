@@ -0,0 +1,312 @@
+"""melty連携ビューのテスト"""
+
+import time
+import uuid
+from unittest import mock
+from urllib.parse import parse_qs, urlsplit
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.sessions.middleware import SessionMiddleware
+from django.core import signing
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from core import melty_views
+from core.melty_integration import MeltyAPIClient
+from core.models import PointTransaction, UserPoint
+
+User = get_user_model()
+
+
+def _with_session(request):
+    SessionMiddleware(lambda r: None).process_request(request)
+    return request
+
+
+class RegisterWithMeltyTests(TestCase):
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.payload = {
+            'melty_user_id': 'm-100',
+            'email': 'taro@example.com',
+            'first_name': 'Taro',
+            'last_name': 'Yamada',
+            'melty_password': 'secret-pass',
+        }
+        credentials = mock.patch.object(MeltyAPIClient, 'verify_user_credentials', return_value={
+            'verified': True,
+            'user_id': 'm-100',
+            'email': 'taro@example.com',
+            'token': '',
+            'user_data': {'id': 'm-100'},
+        })
+        self.verify = credentials.start()
+        self.addCleanup(credentials.stop)
+
+    def _post(self):
+        request = _with_session(self.factory.post('/api/melty/register/', self.payload, format='json'))
+        return request, melty_views.register_with_melty(request)
+
+    def test_duplicate_submission_resolves_to_existing_user(self):
+        _, first = self._post()
+        request, second = self._post()
+
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(second.status_code, 200)
+        self.assertFalse(second.data['is_new_user'])
+        self.assertEqual(second.data['user']['id'], first.data['user']['id'])
+        self.assertEqual(User.objects.filter(melty_user_id='m-100').count(), 1)
+        # 再送でもmelty認証を経てログインセッションが確立される
+        self.assertEqual(self.verify.call_count, 2)
+        self.assertEqual(str(request.session['_auth_user_id']), str(first.data['user']['id']))
+
+    def test_bad_credentials_return_no_user_data(self):
+        self._post()
+        self.verify.return_value = {'verified': False, 'error': 'Invalid credentials'}
+        self.payload.update(email='other@example.com', melty_password='wrong')
+
+        _, response = self._post()
+
+        self.assertEqual(response.status_code, 400)
+        self.assertNotIn('user', response.data)
+
+
+class LinkMeltyAccountTests(TestCase):
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.user = User.objects.create_user(username='bronze', password='x', member_id='B0001', rank='bronze')
+        exchange = mock.patch.object(MeltyAPIClient, 'exchange_code_for_token', return_value={'access_token': 'tok'})
+        exchange.start()
+        self.addCleanup(exchange.stop)
+        profile = mock.patch.object(MeltyAPIClient, 'get_user_profile_with_session', return_value={
+            'user_id': 'm-200', 'email': 'bronze@melty.example',
+        })
+        self.profile = profile.start()
+        self.addCleanup(profile.stop)
+
+    def _link(self, user):
+        request = self.factory.post('/api/melty/link/', {'melty_code': 'code'}, format='json')
+        force_authenticate(request, user=user)
+        return melty_views.link_melty_account(request)
+
+    def test_links_unlinked_account(self):
+        response = self._link(self.user)
+
+        self.assertEqual(response.status_code, 200)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.is_melty_linked)
+        self.assertEqual(self.user.melty_user_id, 'm-200')
+        self.assertEqual(self.user.melty_email, 'bronze@melty.example')
+
+    def test_profile_without_user_id_is_rejected_before_update(self):
+        self.profile.return_value = {'email': 'bronze@melty.example'}
+
+        response = self._link(self.user)
+
+        self.assertEqual(response.status_code, 400)
+        self.user.refresh_from_db()
+        self.assertFalse(self.user.is_melty_linked)
+        self.assertIsNone(self.user.melty_user_id)
+
+    def test_concurrently_linked_account_is_not_relinked(self):
+        # 先行リクエストが連携済み（リクエスト時点のインスタンスは未連携のまま）
+        stale_user = User.objects.get(pk=self.user.pk)
+        User.objects.filter(pk=self.user.pk).update(melty_user_id='m-199', is_melty_linked=True)
+
+        response = self._link(stale_user)
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['error'], '既にmeltyアカウントとリンクされています')
+        self.assertEqual(User.objects.get(pk=self.user.pk).melty_user_id, 'm-199')
+
+    def test_melty_id_owned_by_another_account_is_rejected(self):
+        User.objects.create_user(
+            username='owner', password='x', member_id='S0001', melty_user_id='m-200', is_melty_linked=True
+        )
+
+        response = self._link(self.user)
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['error'], 'このmeltyアカウントは既に他のbiidアカウントとリンクされています')
+        self.user.refresh_from_db()
+        self.assertFalse(self.user.is_melty_linked)
+
+
+class MeltyAuthRateThrottleTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.factory = APIRequestFactory()
+
+    def _get(self, ip):
+        return melty_views.melty_auth_url(self.factory.get('/api/melty/auth-url/', REMOTE_ADDR=ip))
+
+    def test_requests_over_rate_are_throttled_per_ip(self):
+        with mock.patch('core.melty_views.time.time', return_value=1_000_000):
+            statuses = [self._get('10.0.0.1').status_code for _ in range(melty_views.MeltyAuthRateThrottle.rate)]
+            throttled = self._get('10.0.0.1')
+            other_ip = self._get('10.0.0.2')
+
+        self.assertEqual(set(statuses), {200})
+        self.assertEqual(throttled.status_code, 429)
+        self.assertEqual(other_ip.status_code, 200)
+
+    def test_spoofed_forwarded_for_is_still_throttled(self):
+        rate = melty_views.MeltyAuthRateThrottle.rate
+        with mock.patch('core.melty_views.time.time', return_value=1_000_000):
+            statuses = [
+                melty_views.melty_auth_url(self.factory.get(
+                    '/api/melty/auth-url/', REMOTE_ADDR='10.0.0.1', HTTP_X_FORWARDED_FOR=f'203.0.113.{i}'
+                )).status_code
+                for i in range(rate + 1)
+            ]
+
+        self.assertEqual(statuses[-1], 429)
+
+    @override_settings(REST_FRAMEWORK={**settings.REST_FRAMEWORK, 'NUM_PROXIES': 1})
+    def test_trusted_proxy_hop_identifies_client(self):
+        def get(client_ip, spoofed):
+            return melty_views.melty_auth_url(self.factory.get(
+                '/api/melty/auth-url/', REMOTE_ADDR='10.0.0.254', HTTP_X_FORWARDED_FOR=f'{spoofed}, {client_ip}'
+            ))
+
+        with mock.patch('core.melty_views.time.time', return_value=1_000_000):
+            statuses = [
+                get('198.51.100.7', f'203.0.113.{i}').status_code
+                for i in range(melty_views.MeltyAuthRateThrottle.rate + 1)
+            ]
+            other_client = get('198.51.100.8', '203.0.113.1')
+
+        self.assertEqual(statuses[-1], 429)
+        self.assertEqual(other_client.status_code, 200)
+
+    def test_counter_resets_in_next_window(self):
+        window = melty_views.MeltyAuthRateThrottle.window
+        with mock.patch('core.melty_views.time.time', return_value=1_000_000):
+            for _ in range(melty_views.MeltyAuthRateThrottle.rate + 1):
+                self._get('10.0.0.1')
+        with mock.patch('core.melty_views.time.time', return_value=1_000_000 + window):
+            response = self._get('10.0.0.1')
+
+        self.assertEqual(response.status_code, 200)
+
+
+class MeltyOAuthStateTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.factory = APIRequestFactory()
+        exchange = mock.patch.object(MeltyAPIClient, 'exchange_code_for_token', return_value={'access_token': 'tok'})
+        self.exchange = exchange.start()
+        self.addCleanup(exchange.stop)
+        profile = mock.patch.object(MeltyAPIClient, 'get_user_profile_with_session', return_value={'user_id': 'm-300'})
+        profile.start()
+        self.addCleanup(profile.stop)
+
+    def _callback(self, state):
+        request = _with_session(self.factory.get('/api/melty/callback/', {'code': 'auth-code', 'state': state}))
+        return request, melty_views.melty_callback(request)
+
+    def test_auth_url_returns_signed_state(self):
+        response = melty_views.melty_auth_url(self.factory.get('/api/melty/auth-url/'))
+
+        state = response.data['state']
+        query = parse_qs(urlsplit(response.data['auth_url']).query)
+        self.assertEqual(query['state'], [state])
+        self.assertEqual(query['response_type'], ['code'])
+        melty_views._oauth_state_signer.unsign(state, max_age=melty_views.MELTY_OAUTH_STATE_MAX_AGE)
+
+    def test_valid_state_logs_in_linked_user(self):
+        user = User.objects.create_user(
+            username='oauth', password='x', member_id='M-OAUTH', melty_user_id='m-300', is_melty_linked=True
+        )
+        state = melty_views._oauth_state_signer.sign('nonce')
+
+        request, response = self._callback(state)
+
+        self.exchange.assert_called_once_with('auth-code')
+        self.assertEqual(response['Location'], '/user?melty_login=success')
+        self.assertEqual(str(request.session['_auth_user_id']), str(user.pk))
+
+    def test_valid_state_for_unlinked_melty_user_redirects_to_registration(self):
+        _, response = self._callback(melty_views._oauth_state_signer.sign('nonce'))
+
+        self.assertEqual(response['Location'], '/user/register?source=melty&code=auth-code')
+
+    def test_tampered_or_expired_state_is_rejected(self):
+        issued_at = time.time() - melty_views.MELTY_OAUTH_STATE_MAX_AGE - 1
+        with mock.patch('django.core.signing.time.time', return_value=issued_at):
+            expired = melty_views._oauth_state_signer.sign('nonce')
+        tampered = melty_views._oauth_state_signer.sign('nonce') + 'x'
+        unsigned = signing.TimestampSigner(salt='other').sign('nonce')
+
+        for state in (expired, tampered, unsigned, ''):
+            _, response = self._callback(state)
+            self.assertEqual(response['Location'], '/user/login?error=state_mismatch')
+
+        self.exchange.assert_not_called()
+
+
+class RegisterDirectTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.factory = APIRequestFactory()
+        self.payload = {'email': 'ichiro@example.com', 'password': 'secret-pass', 'first_name': 'Ichiro', 'last_name': 'Suzuki'}
+
+    def _post(self, **overrides):
+        request = _with_session(self.factory.post(
+            '/api/melty/register-direct/', {**self.payload, **overrides}, format='json'
+        ))
+        return request, melty_views.register_direct(request)
+
+    def test_creates_bronze_user_with_welcome_bonus(self):
+        request, response = self._post()
+
+        self.assertEqual(response.status_code, 201)
+        user = User.objects.get(pk=response.data['user']['id'])
+        self.assertEqual(user.username, 'ichiro_suzuki')
+        self.assertRegex(user.member_id, r'^B[0-9A-F]{8}$')
+        self.assertEqual(user.rank, 'bronze')
+        self.assertEqual(
+            list(UserPoint.objects.filter(user=user).values_list('points', flat=True)),
+            [melty_views.DIRECT_WELCOME_BONUS_POINTS],
+        )
+        self.assertEqual(
+            list(PointTransaction.objects.filter(user=user).values_list('points', 'balance_before', 'balance_after')),
+            [(melty_views.DIRECT_WELCOME_BONUS_POINTS, 0, melty_views.DIRECT_WELCOME_BONUS_POINTS)],
+        )
+        self.assertEqual(str(request.session['_auth_user_id']), str(user.pk))
+
+    def test_taken_username_gets_random_suffix(self):
+        User.objects.create_user(username='ichiro_suzuki', password='x', member_id='M-TAKEN', email='other@example.com')
+
+        _, response = self._post()
+
+        self.assertEqual(response.status_code, 201)
+        self.assertRegex(response.data['user']['username'], r'^ichiro_suzuki_[0-9a-f]{6}$')
+
+    def test_unique_violation_retries_with_new_identifiers(self):
+        colliding = uuid.UUID('abcdef12' + '0' * 24)
+        User.objects.create_user(username='someone', password='x', member_id='BABCDEF12', email='someone@example.com')
+
+        with mock.patch('core.melty_views.uuid.uuid4', side_effect=[colliding, uuid.uuid4()]):
+            _, response = self._post()
+
+        self.assertEqual(response.status_code, 201)
+        user = User.objects.get(pk=response.data['user']['id'])
+        self.assertNotEqual(user.member_id, 'BABCDEF12')
+        self.assertRegex(user.username, r'^ichiro_suzuki_[0-9a-f]{6}$')
+        self.assertEqual(UserPoint.objects.filter(user=user).count(), 1)
+
+    def test_email_is_normalized_and_matched_case_insensitively(self):
+        _, first = self._post(email='  Ichiro@Example.COM ')
+        _, second = self._post(email='ICHIRO@example.com', first_name='Other')
+
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(User.objects.get(pk=first.data['user']['id']).email, 'ichiro@example.com')
+        self.assertEqual(second.status_code, 400)
+        self.assertEqual(second.data['error'], 'このメールアドレスは既に登録されています')
+        self.assertEqual(User.objects.filter(email__iexact='ichiro@example.com').count(), 1)
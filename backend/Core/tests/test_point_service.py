@@ -0,0 +1,62 @@
+"""PointService.check_expired_points のテスト"""
+
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.utils import timezone
+
+from core.models import Notification, PointTransaction, UserPoint
+from core.point_service import PointService
+
+User = get_user_model()
+
+
+class CheckExpiredPointsTests(TestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user(username='alice', password='x', member_id='M-ALICE')
+        self.bob = User.objects.create_user(username='bob', password='x', member_id='M-BOB')
+        past = timezone.now() - timedelta(days=1)
+        future = timezone.now() + timedelta(days=30)
+        UserPoint.objects.create(user=self.alice, points=300, expiry_date=future)
+        self.alice_first = UserPoint.objects.create(user=self.alice, points=100, expiry_date=past)
+        self.bob_expired = UserPoint.objects.create(user=self.bob, points=50, expiry_date=past)
+        self.alice_second = UserPoint.objects.create(user=self.alice, points=200, expiry_date=past)
+
+    def test_running_balances_across_chunks(self):
+        service = PointService()
+        service.expire_batch_size = 2
+
+        self.assertEqual(service.check_expired_points(), 3)
+
+        self.assertEqual(
+            list(UserPoint.objects.filter(is_expired=True).order_by('id').values_list('id', flat=True)),
+            [self.alice_first.id, self.bob_expired.id, self.alice_second.id],
+        )
+        alice_history = list(
+            PointTransaction.objects.filter(user=self.alice, transaction_type='expire')
+            .order_by('id').values_list('points', 'balance_before', 'balance_after')
+        )
+        # 1チャンク目: 600 → 500、2チャンク目は残高を再集計して 500 → 300
+        self.assertEqual(alice_history, [(-100, 600, 500), (-200, 500, 300)])
+        self.assertEqual(
+            list(PointTransaction.objects.filter(user=self.bob).values_list('points', 'balance_before', 'balance_after')),
+            [(-50, 50, 0)],
+        )
+        self.assertEqual(Notification.objects.filter(user=self.alice).count(), 2)
+        self.assertEqual(Notification.objects.filter(user=self.bob).count(), 1)
+
+    def test_running_balance_within_one_chunk(self):
+        self.assertEqual(PointService().check_expired_points(), 3)
+
+        alice_history = list(
+            PointTransaction.objects.filter(user=self.alice, transaction_type='expire')
+            .order_by('id').values_list('balance_before', 'balance_after')
+        )
+        self.assertEqual(alice_history, [(600, 500), (500, 300)])
+
+    def test_nothing_to_expire(self):
+        UserPoint.objects.update(is_expired=True)
+
+        self.assertEqual(PointService().check_expired_points(), 0)
+        self.assertFalse(PointTransaction.objects.exists())
@@ -0,0 +1,92 @@
+"""5カテゴリ設定モデルのキャッシュのテスト"""
+
+import json
+from decimal import Decimal
+from unittest import mock
+
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.test import TestCase
+
+from core.models import BusinessOperationSettings, SystemInfrastructureSettings
+
+
+class JSONRoundTripCache:
+    """本番Redisキャッシュ（JSONシリアライザ）と同じく値をJSONで保持するキャッシュ"""
+
+    def __init__(self):
+        self.store = {}
+
+    def get(self, key, default=None):
+        return json.loads(self.store[key]) if key in self.store else default
+
+    def set(self, key, value, timeout=None):
+        self.store[key] = json.dumps(value, cls=DjangoJSONEncoder)
+
+    def add(self, key, value, timeout=None):
+        if key in self.store:
+            return False
+        self.set(key, value)
+        return True
+
+    def incr(self, key):
+        if key not in self.store:
+            raise ValueError(key)
+        self.set(key, self.get(key) + 1)
+        return self.get(key)
+
+
+class CachedSettingsManagerTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_cached_read_skips_query(self):
+        SystemInfrastructureSettings.get_settings()
+
+        with self.assertNumQueries(0):
+            settings = SystemInfrastructureSettings.get_settings()
+        self.assertEqual(settings.pk, 1)
+
+    def test_save_from_another_instance_invalidates(self):
+        SystemInfrastructureSettings.get_settings()
+
+        other = SystemInfrastructureSettings.objects.get(pk=1)
+        other.site_name = 'Renamed'
+        other.save()
+
+        self.assertEqual(SystemInfrastructureSettings.get_settings().site_name, 'Renamed')
+
+    def test_queryset_update_invalidates(self):
+        SystemInfrastructureSettings.get_settings()
+
+        SystemInfrastructureSettings.objects.filter(pk=1).update(maintenance_mode=True)
+
+        self.assertTrue(SystemInfrastructureSettings.get_settings().maintenance_mode)
+
+    def test_stale_value_written_back_after_update_is_not_served(self):
+        stale_key = SystemInfrastructureSettings.objects._entry_key()
+        stale = SystemInfrastructureSettings.get_settings()
+
+        SystemInfrastructureSettings.objects.filter(pk=1).update(site_name='Fresh')
+        # 更新前に読み込んだワーカーが旧世代キーへ書き戻しても参照されない
+        cache.set(stale_key, {'id': 1, 'site_name': stale.site_name}, 30)
+
+        self.assertEqual(SystemInfrastructureSettings.get_settings().site_name, 'Fresh')
+
+    def test_json_cached_values_keep_field_types(self):
+        with mock.patch('core.models.cache', JSONRoundTripCache()):
+            original = BusinessOperationSettings.get_settings()
+            cached = BusinessOperationSettings.get_settings()
+
+        self.assertIsInstance(cached.default_point_rate, Decimal)
+        self.assertEqual(cached.default_point_rate, original.default_point_rate)
+        self.assertEqual(cached.created_at, original.created_at)
+
+
+class SettingsSeedMigrationTests(TestCase):
+    def test_seeded_row_exists_and_next_insert_gets_new_id(self):
+        self.assertTrue(SystemInfrastructureSettings.objects.filter(pk=1).exists())
+
+        created = SystemInfrastructureSettings.objects.create(site_name='Second')
+
+        self.assertNotEqual(created.pk, 1)
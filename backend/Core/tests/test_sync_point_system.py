@@ -0,0 +1,99 @@
+"""sync_point_system 管理コマンドのテスト"""
+
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase
+
+from core.management.commands.sync_point_system import Command
+from core.models import AccountRank, Notification, PointTransaction, UserPoint
+
+User = get_user_model()
+
+
+class SyncUserPointsTests(TestCase):
+    def _run(self):
+        out, err = StringIO(), StringIO()
+        command = Command(stdout=out, stderr=err)
+        command.sync_user_points()
+        return out.getvalue(), err.getvalue()
+
+    def _add_legacy_points_column(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f"ALTER TABLE {User._meta.db_table} ADD COLUMN points integer DEFAULT 0")
+
+    def test_missing_legacy_column_is_skipped(self):
+        out, _ = self._run()
+
+        self.assertIn('No old points field found', out)
+
+    def test_legacy_points_are_migrated(self):
+        self._add_legacy_points_column()
+        user = User.objects.create_user(username='legacy', password='x', member_id='L0001')
+        with connection.cursor() as cursor:
+            cursor.execute(f"UPDATE {User._meta.db_table} SET points = 300 WHERE id = %s", [user.pk])
+
+        out, _ = self._run()
+
+        self.assertIn('Migrated points for 1 users', out)
+        self.assertEqual(UserPoint.objects.get(user=user).points, 300)
+        self.assertEqual(PointTransaction.objects.get(user=user).balance_after, 300)
+
+    def test_batch_insert_failure_is_reported_and_raised(self):
+        self._add_legacy_points_column()
+        user = User.objects.create_user(username='legacy', password='x', member_id='L0002')
+        with connection.cursor() as cursor:
+            cursor.execute(f"UPDATE {User._meta.db_table} SET points = 300 WHERE id = %s", [user.pk])
+
+        out, err = StringIO(), StringIO()
+        with mock.patch.object(UserPoint.objects, 'bulk_create', side_effect=RuntimeError('insert failed')):
+            with self.assertRaises(RuntimeError):
+                Command(stdout=out, stderr=err).sync_user_points()
+
+        self.assertIn('Point migration failed: insert failed', err.getvalue())
+        self.assertNotIn('No old points field found', out.getvalue())
+
+
+class SyncUserRanksTests(TestCase):
+    def setUp(self):
+        for rank, required_points in [('bronze', 0), ('silver', 1000), ('gold', 5000)]:
+            AccountRank.objects.update_or_create(rank=rank, defaults={'required_points': required_points})
+
+    def _customer(self, username, rank='bronze', grants=()):
+        user = User.objects.create_user(username=username, password='x', member_id=username.upper(), rank=rank)
+        for transaction_type, points in grants:
+            PointTransaction.objects.create(user=user, points=points, transaction_type=transaction_type)
+        return user
+
+    def test_ranks_match_check_and_update_rank(self):
+        silver = self._customer('silver', grants=[('grant', 700), ('bonus', 500), ('use', -900)])
+        gold = self._customer('gold', grants=[('grant', 4000), ('bonus', 1000)])
+        unchanged = self._customer('unchanged', rank='silver', grants=[('grant', 1500)])
+        below = self._customer('below', grants=[('grant', 999), ('expire', -100)])
+
+        Command(stdout=StringIO()).sync_user_ranks()
+
+        ranks = dict(User.objects.values_list('username', 'rank'))
+        self.assertEqual(ranks['silver'], 'silver')
+        self.assertEqual(ranks['gold'], 'gold')
+        self.assertEqual(ranks['unchanged'], 'silver')
+        self.assertEqual(ranks['below'], 'bronze')
+        self.assertEqual(
+            set(Notification.objects.values_list('user_id', flat=True)), {silver.pk, gold.pk}
+        )
+        # モデル側の判定と一致（再判定しても変化しない）
+        for user in (silver, gold, unchanged, below):
+            user.refresh_from_db()
+            before = user.rank
+            user.check_and_update_rank()
+            self.assertEqual(user.rank, before)
+
+    def test_dry_run_changes_nothing(self):
+        self._customer('silver', grants=[('grant', 1200)])
+
+        Command(stdout=StringIO()).sync_user_ranks(dry_run=True)
+
+        self.assertEqual(User.objects.get(username='silver').rank, 'bronze')
+        self.assertFalse(Notification.objects.exists())
@@ -92,6 +92,7 @@ INSTALLED_APPS = [
 MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'django.middleware.gzip.GZipMiddleware',
     
     # 本番環境用セキュリティミドルウェア（本番優先）
     'core.production_middleware.ProductionSecurityMiddleware',
@@ -196,6 +197,9 @@ REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
     ],
+    # スロットリングのクライアント識別に使う信頼済みリバースプロキシの段数
+    # 0 の場合は X-Forwarded-For を無視して REMOTE_ADDR を使う（クライアントが偽装したXFFで制限を回避できないように）
+    'NUM_PROXIES': config('DRF_NUM_PROXIES', default=0, cast=int),
 }
 
 if DEBUG:
@@ -296,6 +300,9 @@ LOGGING = {
     },
 }
 
+# ハンドラへの書き込みはQueueListenerのバックグラウンドスレッドで実行
+LOGGING_CONFIG = 'core.logging_config.configure_logging'
+
 # キャッシュ設定（Redis対応）
 if config('USE_REDIS', default=False, cast=bool):
     CACHES = {
@@ -312,6 +319,7 @@ if config('USE_REDIS', default=False, cast=bool):
                 },
                 'SERIALIZER': 'django_redis.serializers.json.JSONSerializer',
                 'COMPRESSOR': 'django_redis.compressors.zlib.ZlibCompressor',
+                'IGNORE_EXCEPTIONS': True,  # Redis障害時もキャッシュミスとして処理を継続
             },
             'KEY_PREFIX': config('REDIS_KEY_PREFIX', default='biid_prod'),
             'TIMEOUT': config('CACHE_TIMEOUT', default=300, cast=int),
@@ -347,6 +355,8 @@ FINCODE_SECRET_KEY = os.getenv("FINCODE_SECRET_KEY", "")
 FINCODE_SHOP_ID = os.getenv("FINCODE_SHOP_ID", "")
 FINCODE_API_BASE_URL = os.getenv("FINCODE_API_BASE_URL", "https://api.test.fincode.jp")  # テスト環境URL
 FINCODE_IS_PRODUCTION = os.getenv("FINCODE_IS_PRODUCTION", "false").lower() == "true"
+FINCODE_WEBHOOK_SIGNATURE = os.getenv("FINCODE_WEBHOOK_SIGNATURE", "")  # FINCODE管理画面のWebhook設定で登録した署名（未設定時は検証しない）
+FINCODE_MOCK_FAST = os.getenv("FINCODE_MOCK_FAST", "false").lower() == "true"  # モック応答の遅延シミュレートを無効化（CI用）
 
 # 決済ゲートウェイ設定（FINCODE統一）
 PAYMENT_GATEWAY = "fincode"
@@ -354,3 +364,11 @@ PAYMENT_GATEWAY = "fincode"
 # MELTY API連携設定（既存API活用版）
 MELTY_API_BASE_URL = os.getenv('MELTY_API_BASE_URL', 'http://app-melty.com/melty-app_system/api')
 # APIキー不要（既存ログインAPIを直接使用）
+MELTY_CONNECT_TIMEOUT = float(os.getenv('MELTY_CONNECT_TIMEOUT', '3.05'))  # 接続確立タイムアウト（秒）
+MELTY_READ_TIMEOUT = float(os.getenv('MELTY_READ_TIMEOUT', '10'))  # レスポンス読み取りタイムアウト（秒）
+MELTY_ENABLE_HTML_FALLBACK = os.getenv('MELTY_ENABLE_HTML_FALLBACK', 'false').lower() == 'true'  # プロフィールAPI失敗時にダッシュボードHTMLから抽出
+# OAuth認可コードフロー（melty_auth_url / melty_callback / link_melty_account）
+MELTY_OAUTH_AUTHORIZE_URL = os.getenv('MELTY_OAUTH_AUTHORIZE_URL', f'{MELTY_API_BASE_URL}/oauth/authorize')
+MELTY_OAUTH_CLIENT_ID = os.getenv('MELTY_OAUTH_CLIENT_ID', '')
+MELTY_OAUTH_CLIENT_SECRET = os.getenv('MELTY_OAUTH_CLIENT_SECRET', '')
+MELTY_OAUTH_REDIRECT_URI = os.getenv('MELTY_OAUTH_REDIRECT_URI', '')
@@ -2,7 +2,7 @@ from django.contrib import admin
 from django.urls import path, include
 from django.http import JsonResponse
 from core.test_views import PartnerAPITestView, api_status, get_totp
-from core import fincode_views
+from core.fincode_urls import payment_views as fincode_payment_views
 from core.custom_admin import custom_admin_site
 
 def health(_request):  # フロント互換のヘルスエンドポイント
@@ -17,7 +17,7 @@ urlpatterns = [
     path('api/partner/', include('core.partner_urls')),
     path('api/fincode/', include('core.fincode_urls')),  # FINCODE決済API（統一）
     # 互換目的：POSTのAPPEND_SLASHが効かないケースのため両方受ける
-    path('api/fincode/payment/initiate', fincode_views.initiate_payment, name='fincode_initiate_no_slash'),
+    path('api/fincode/payment/initiate', fincode_payment_views.initiate_payment, name='fincode_initiate_no_slash'),
     path('api/status/', api_status, name='api-status'),
     path('api/health/', health, name='api-health'),   # 追加: /api/health/
     path('api/get-totp/', get_totp, name='get-totp'),